@@ -0,0 +1,202 @@
+"""
+Process-wide admission control for the Azure services.
+
+Every session's requests for a service go through one ``ServiceScheduler``
+on the engine loop instead of hitting Azure the moment they are made. The
+scheduler admits requests round-robin across sessions (so one user's burst
+of TTS sentences can't starve another user's transcription), up to the
+concurrency cap and within token-bucket RPM/TPM limits sized to the
+deployment's quota. The queue is bounded: when it is full, or a request has
+waited ``max_wait_s``, it fails fast with ``Overloaded`` so the requests
+that were admitted still finish, instead of everyone timing out together.
+
+A throttled request is retried after the server's ``Retry-After`` plus
+jitter (see ``retry_delay``), so the sessions caught by the same 429 burst
+don't all come back at the same instant.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import openai
+
+from metrics import Metrics, metrics
+from ratelimit import TokenBucket
+from router import retry_after
+
+
+class Overloaded(RuntimeError):
+    """The service's queue is full (or the wait ran out); try again after ``retry_after_s``."""
+
+    def __init__(self, service: str, retry_after_s: float, reason: str = "queue full"):
+        super().__init__(f"{service} is overloaded ({reason}); retry in ~{retry_after_s:.0f} s")
+        self.service = service
+        self.retry_after_s = retry_after_s
+
+
+def retry_delay(exc: Exception, attempt: int) -> float | None:
+    """Seconds to wait before retrying ``exc``, or None if it isn't worth retrying.
+
+    Throttling, timeouts, dropped connections and 5xx are retried with
+    exponential backoff; ``Retry-After`` is honoured as a minimum. Up to 50%
+    jitter is added on top so throttled sessions spread out.
+    """
+    if isinstance(exc, openai.APIStatusError):
+        if exc.status_code != 429 and exc.status_code != 408 and exc.status_code < 500:
+            return None
+    elif not isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+        return None
+    base = retry_after(exc)
+    if base is None:
+        base = 0.5 * 2 ** attempt
+    return base + random.uniform(0, base / 2)
+
+
+@dataclass
+class Ticket:
+    session: str
+    tokens: float
+    future: asyncio.Future
+    enqueued: float = field(default_factory=time.monotonic)
+    state: str = "queued"  # → granting → granted, or abandoned
+
+
+class ServiceScheduler:
+    """Fair, rate-limited admission to one service."""
+
+    def __init__(self, service: str, concurrency: int, rpm: float = 0.0, tpm: float = 0.0,
+                 max_queue: int = 256, max_wait_s: float = 30.0, registry: Metrics = metrics):
+        self.service = service
+        self.concurrency = concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self.registry = registry
+        self._rpm = TokenBucket.per_minute(rpm) if rpm > 0 else None
+        self._tpm = TokenBucket.per_minute(tpm) if tpm > 0 else None
+        self.active = 0
+        self.queued = 0
+        self.avg_hold_s = 0.0
+        self.stats = {"admitted": 0, "rejected": 0, "timed_out": 0, "throttled": 0}
+        # Session → its waiting tickets; dict order is the round-robin rotation
+        self._queues: dict[str, deque[Ticket]] = {}
+        self._lock = threading.Lock()
+        self._changed = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+
+    # --- Waiting side ---
+    async def acquire(self, session: str, tokens: float = 1.0) -> None:
+        """Wait until this request is admitted; ``release()`` must follow."""
+        if self.queued >= self.max_queue:
+            self._count("rejected")
+            raise Overloaded(self.service, self.estimate_wait(self.queued + 1))
+        ticket = Ticket(session, tokens, asyncio.get_running_loop().create_future())
+        with self._lock:
+            self._queues.setdefault(session, deque()).append(ticket)
+            self.queued += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        self._changed.set()
+        try:
+            await asyncio.wait([ticket.future], timeout=self.max_wait_s)
+        except asyncio.CancelledError:
+            if ticket.state == "granted":
+                self.release(0.0)
+            self._abandon(ticket)
+            raise
+        if ticket.state != "granted":
+            self._abandon(ticket)
+            self._count("timed_out")
+            raise Overloaded(self.service, self.estimate_wait(self.queued + 1), reason="waited too long")
+
+    def release(self, held_s: float) -> None:
+        self.active -= 1
+        self.avg_hold_s = held_s if not self.avg_hold_s else 0.8 * self.avg_hold_s + 0.2 * held_s
+        self._changed.set()
+
+    def throttled(self) -> None:
+        """Count a 429 from the service (the request is retried by the engine)."""
+        self._count("throttled")
+
+    def _abandon(self, ticket: Ticket) -> None:
+        with self._lock:
+            if ticket.state == "queued":
+                queue = self._queues.get(ticket.session)
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+                    self.queued -= 1
+                    if not queue:
+                        del self._queues[ticket.session]
+            # A ticket being granted keeps its reserved slot until the dispatcher sees this
+            if ticket.state != "granted":
+                ticket.state = "abandoned"
+
+    # --- Admitting side ---
+    def _pop(self) -> Ticket:
+        with self._lock:
+            session = next(iter(self._queues))
+            queue = self._queues.pop(session)
+            ticket = queue.popleft()
+            if queue:
+                # To the back of the rotation: every other waiting session goes first
+                self._queues[session] = queue
+            self.queued -= 1
+            ticket.state = "granting"
+            return ticket
+
+    async def _dispatch(self) -> None:
+        # Runs while anything is queued; acquire() starts it again
+        while self.queued:
+            if self.active >= self.concurrency:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+            ticket = self._pop()
+            self.active += 1
+            if self._rpm is not None:
+                await self._rpm.acquire()
+            if self._tpm is not None and ticket.tokens:
+                await self._tpm.acquire(ticket.tokens)
+            if ticket.state == "abandoned" or ticket.future.done():
+                self.active -= 1
+                continue
+            ticket.state = "granted"
+            ticket.future.set_result(None)
+            self._count("admitted")
+            self.registry.observe(f"queue_{self.service}", time.monotonic() - ticket.enqueued)
+
+    def _count(self, result: str) -> None:
+        self.stats[result] += 1
+        self.registry.incr("admission_total", self.service, result)
+
+    # --- Reporting ---
+    def estimate_wait(self, place: int) -> float:
+        """Rough seconds until the request at ``place`` in the rotation is admitted."""
+        wait = 0.0
+        if self._rpm is not None:
+            wait = max(0.0, place - self._rpm.tokens) / self._rpm.rate
+        if self.active >= self.concurrency:
+            wait = max(wait, place / self.concurrency * (self.avg_hold_s or 1.0))
+        return wait
+
+    def position(self, session: str) -> tuple[int, float] | None:
+        """(place in the rotation, estimated wait) while ``session`` has a request queued."""
+        with self._lock:
+            if session not in self._queues:
+                return None
+            place = list(self._queues).index(session) + 1
+        return place, self.estimate_wait(place)
+
+    def load(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.queued,
+            "limit": self.concurrency,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            **self.stats,
+        }
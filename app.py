@@ -1,60 +1,33 @@
 import streamlit as st
 from streamlit_mic_recorder import mic_recorder
-from openai import AzureOpenAI
 import os
 import time
-import base64
 import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from dotenv import load_dotenv
-import json
-from pathlib import Path
+import uuid
+from contextlib import nullcontext
 
-# Load environment variables
+# Load environment variables (before the local modules below read their settings)
 load_dotenv()
 
-# --- Language detection (Hindi vs English) ---
-def detect_hi_en(text: str) -> str:
-    """Return 'hi' if text is predominantly Hindi (Devanagari), else 'en'."""
-    if not text:
-        return 'en'
-    devanagari = sum(1 for ch in text if '\u0900' <= ch <= '\u097F')
-    letters = sum(1 for ch in text if ch.isalpha())
-    # If at least 30% of letters are Devanagari, treat as Hindi
-    if letters > 0 and (devanagari / letters) >= 0.3:
-        return 'hi'
-    return 'en'
-
-# Helpers to read settings from environment or Streamlit Secrets
-def _get_env_or_secret(key: str, default: str | None = None) -> str | None:
-    val = os.getenv(key)
-    if not val:
-        try:
-            # st.secrets returns None if key not present
-            val = st.secrets.get(key)  # type: ignore[attr-defined]
-        except Exception:
-            val = None
-    return val if val else default
-
-# Helpers to create per-service clients (chat, stt, tts)
-def make_client(prefix: str) -> AzureOpenAI:
-    api_key = _get_env_or_secret(f"{prefix}_API_KEY") or _get_env_or_secret("AZURE_OPENAI_API_KEY")
-    endpoint = _get_env_or_secret(f"{prefix}_ENDPOINT") or _get_env_or_secret("AZURE_OPENAI_ENDPOINT")
-    api_version = _get_env_or_secret(f"{prefix}_API_VERSION") or _get_env_or_secret("AZURE_OPENAI_API_VERSION")
-    return AzureOpenAI(api_key=api_key, api_version=api_version, azure_endpoint=endpoint)
-
-# Helper to validate that either per-service or global credentials exist
-def _missing_creds(prefix: str) -> list[str]:
-    api_key = _get_env_or_secret(f"{prefix}_API_KEY") or _get_env_or_secret("AZURE_OPENAI_API_KEY")
-    endpoint = _get_env_or_secret(f"{prefix}_ENDPOINT") or _get_env_or_secret("AZURE_OPENAI_ENDPOINT")
-    api_version = _get_env_or_secret(f"{prefix}_API_VERSION") or _get_env_or_secret("AZURE_OPENAI_API_VERSION")
-    missing: list[str] = []
-    if not api_key:
-        missing.append(f"{prefix}_API_KEY or AZURE_OPENAI_API_KEY")
-    if not endpoint:
-        missing.append(f"{prefix}_ENDPOINT or AZURE_OPENAI_ENDPOINT")
-    if not api_version:
-        missing.append(f"{prefix}_API_VERSION or AZURE_OPENAI_API_VERSION")
-    return missing
+from admission import Overloaded
+from audio_buffers import get_audio_buffers, process_rss_bytes
+from audio_format import PREFERENCES, negotiate
+from clients import client_count
+from engine import TurnCancelled, get_engine, iter_sync, run_sync, submit
+from router import get_pool
+from audio_prep import prep_settings, segment_for_stt, segment_settings
+from media_store import audio_url
+from metrics import metrics, start_turn
+from tts_cache import get_tts_cache
+from reply_cache import get_reply_cache
+from prefs_store import get_prefs_store
+from settings import CHAT_PREFIX, STT_PREFIX, TTS_PREFIX, get_env_or_secret, missing_creds
+from pipeline import TurnCache, build_system_hint, stage_key
+from lang_detect import LANGUAGE_NAMES, detect_language
+from conversation import Conversation, estimate_messages_tokens
+from warmup import first_turn, get_warmup, note_turn, start_warmup
 
 # Page configuration
 st.set_page_config(
@@ -78,36 +51,27 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- Smart memory (preferences) ---
-MEMORY_PATH = Path(__file__).parent / "memory.json"
-
-def load_memory():
-    try:
-        if MEMORY_PATH.exists():
-            with open(MEMORY_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return {
-        "preferred_name": "",
-        "speak_style": "normal",  # normal | slower | faster
-    }
-
-def save_memory(mem: dict):
-    try:
-        with open(MEMORY_PATH, "w", encoding="utf-8") as f:
-            json.dump(mem, f, ensure_ascii=False, indent=2)
-    except Exception:
-        # Non-fatal; just ignore save errors
-        pass
-
-if "memory" not in st.session_state:
-    st.session_state["memory"] = load_memory()
-# Render a speaking avatar synced to audio (shows on play, hides on end)
-def render_cat_audio(audio_bytes: bytes, label: str = "AI speaking…"):
-        data_url = "data:audio/mpeg;base64," + base64.b64encode(audio_bytes).decode("ascii")
-        html = f"""
-        <div class="cat-audio-container" id="cat-audio">
+# --- Smart memory (preferences), stored per user ---
+prefs_store = get_prefs_store()
+
+def _user_id() -> str:
+    """Stable id for this browser: ``?uid=`` in the URL, added on the first visit."""
+    uid = (st.query_params.get("uid") or "")[:64]
+    if not uid:
+        uid = st.session_state.get("user_id") or uuid.uuid4().hex
+        st.query_params["uid"] = uid
+    return uid
+
+if "memory" not in st.session_state or st.session_state.get("user_id") != _user_id():
+    st.session_state["user_id"] = _user_id()
+    st.session_state["memory"] = prefs_store.get(st.session_state["user_id"])
+# --- Conversation history (this session only) ---
+if "conversation" not in st.session_state:
+    st.session_state["conversation"] = Conversation.from_env()
+
+# Avatar markup + styles shared by the single-clip and streamed players
+def _cat_avatar(label: str) -> str:
+        return f"""
             <style>
                 .cat-wrap {{ display:none; align-items:center; gap:12px; margin: 6px 0 4px; }}
                 .cat {{ position:relative; width:64px; height:64px; border-radius:16px; background:linear-gradient(180deg,#fbbf24,#eab308); box-shadow:0 8px 16px rgba(0,0,0,0.15); border:1px solid rgba(0,0,0,0.05); }}
@@ -130,8 +94,17 @@ def render_cat_audio(audio_bytes: bytes, label: str = "AI speaking…"):
                 </div>
                 <div class="cat-label">{label}</div>
             </div>
+        """
+
+# Render a speaking avatar synced to audio (shows on play, hides on end)
+def render_cat_audio(audio_bytes: bytes, label: str = "AI speaking…", mimetype: str = "audio/mpeg"):
+        # Served by URL (with range requests) rather than inlined as base64
+        src = audio_url(audio_bytes, mimetype, "reply.0")
+        html = f"""
+        <div class="cat-audio-container" id="cat-audio">
+{_cat_avatar(label)}
             <div class="audio-wrap">
-                <audio id="cat-audio-el" src="{data_url}" controls autoplay></audio>
+                <audio id="cat-audio-el" src="{src}" controls autoplay></audio>
             </div>
       
             <script>
@@ -152,12 +125,76 @@ def render_cat_audio(audio_bytes: bytes, label: str = "AI speaking…"):
         """
         components.html(html, height=150)
 
+# Render one sentence of a streamed reply. Segment 0 owns the visible player and
+# avatar; later segments are zero-height frames that hand their audio to it via a
+# per-turn queue on the parent window, so sentences play back-to-back in order.
+def render_cat_audio_segment(turn_id: str, index: int, audio_bytes: bytes, label: str = "AI speaking…", mimetype: str = "audio/mpeg"):
+        src = audio_url(audio_bytes, mimetype, f"reply.{index}")
+        register = f"""
+                const P = window.parent || window;
+                P.__catTurns = P.__catTurns || {{}};
+                const turn = P.__catTurns["{turn_id}"] = P.__catTurns["{turn_id}"] || {{ srcs: {{}}, kick: () => {{}} }};
+                turn.srcs[{index}] = "{src}";
+                turn.kick();
+        """
+        if index > 0:
+            components.html(f"<script>(function() {{ {register} }})();</script>", height=0)
+            return
+        html = f"""
+        <div class="cat-audio-container" id="cat-audio">
+{_cat_avatar(label)}
+            <div class="audio-wrap">
+                <audio id="cat-audio-el" controls></audio>
+            </div>
+
+            <script>
+                (function() {{
+                    {register}
+                    const wrap = document.querySelector('#cat-audio .cat-wrap');
+                    const audio = document.getElementById('cat-audio-el');
+                    if (!wrap || !audio) return;
+                    let next = 0;
+                    let busy = false;
+                    const show = () => wrap.style.display = 'flex';
+                    const hide = () => wrap.style.display = 'none';
+                    const advance = () => {{
+                        if (busy || !(next in turn.srcs)) return;
+                        busy = true;
+                        audio.src = turn.srcs[next++];
+                        audio.play().catch(() => {{ busy = false; }});
+                    }};
+                    audio.addEventListener('play', show);
+                    audio.addEventListener('playing', show);
+                    audio.addEventListener('ended', () => {{
+                        busy = false;
+                        if (next in turn.srcs) advance(); else hide();
+                    }});
+                    turn.kick = advance;
+                    advance();
+                }})();
+            </script>
+        </div>
+        """
+        components.html(html, height=150)
+
+def _show_tts_error(tts_error: Exception):
+    st.warning("⚠️ Text-to-speech is not available yet. You can read the response above.")
+    st.info(f"TTS Error: {str(tts_error)[:160]}")
+    st.caption(
+        "Using endpoint: "
+        + (os.getenv("AZURE_OPENAI_TTS_ENDPOINT") or os.getenv("AZURE_OPENAI_ENDPOINT", "Not set"))
+        + " | API version: "
+        + (os.getenv("AZURE_OPENAI_TTS_API_VERSION") or os.getenv("AZURE_OPENAI_API_VERSION", "Not set"))
+        + " | Deployment: "
+        + (os.getenv("AZURE_OPENAI_TTS_DEPLOYMENT") or "tts")
+    )
+
 # Manual test panel removed as requested
 
 # Validate credentials per service (allowing per-service overrides or global fallbacks)
-missing_chat = _missing_creds("AZURE_OPENAI_CHAT")
-missing_stt = _missing_creds("AZURE_OPENAI_WHISPER")
-missing_tts = _missing_creds("AZURE_OPENAI_TTS")
+missing_chat = missing_creds(CHAT_PREFIX)
+missing_stt = missing_creds(STT_PREFIX)
+missing_tts = missing_creds(TTS_PREFIX)
 
 if missing_chat or missing_stt or missing_tts:
     st.error("⚠️ Missing Azure OpenAI configuration.")
@@ -170,10 +207,50 @@ if missing_chat or missing_stt or missing_tts:
     st.info("Set these in a local `.env` (not committed) or in Streamlit Cloud → Settings → Environment variables. See `.env.example` for names and versions.")
     st.stop()
 
-# Create clients only after validation so app fails gracefully if env vars are absent
-chat_client = make_client("AZURE_OPENAI_CHAT")
-stt_client = make_client("AZURE_OPENAI_WHISPER")
-tts_client = make_client("AZURE_OPENAI_TTS")
+# Fetch clients only after validation so app fails gracefully if env vars are absent.
+# They are pooled process-wide, so reruns and other sessions reuse open connections.
+# Each service routes across its endpoint pool (AZURE_OPENAI_<SERVICE>_POOL) with failover.
+# All calls run on the shared engine loop; run_sync/iter_sync wait for them here.
+chat_pool = get_pool("chat")
+stt_pool = get_pool("stt")
+tts_pool = get_pool("tts")
+engine = get_engine()
+# Opt-in (WARMUP_ENABLED=1): connect to and keep-warm every endpoint once per server process,
+# in the background, so the first visitor after a rollout doesn't pay for cold connections
+start_warmup()
+# Reply clips kept for reruns live in a byte-budgeted store that spills to disk, not in session state
+audio_buffers = get_audio_buffers()
+_ctx = get_script_run_ctx()
+session_id = _ctx.session_id if _ctx else ""
+
+
+def _client_headers() -> dict:
+    """This session's request headers (User-Agent, client hints); empty outside a Streamlit server."""
+    try:
+        return {name.lower(): value for name, value in st.context.headers.items()}
+    except Exception:
+        return {}
+
+
+# Reply audio format for this browser and connection: the sidebar choice, else TTS_FORMAT, else auto
+_format_default = get_env_or_secret("TTS_FORMAT", "auto")
+reply_format, format_reason = negotiate(st.session_state.get("audio_format", _format_default), _client_headers())
+
+
+def _remember_turn(conversation: Conversation, turn_key: str, user_text: str, sentences: list[str], trace):
+    """Add the turn to the session history and fold old turns into the summary in the background."""
+    conversation.record(turn_key, user_text, " ".join(sentences))
+    submit(engine.fold_history(chat_pool, conversation, trace))
+
+
+def _hold_reply_audio(clips: list[bytes]) -> list[str]:
+    """Keep the reply clips in this session's audio buffers; the turn cache stores the names."""
+    audio_buffers.drop(session_id, "reply.")
+    names = [f"reply.{index}" for index in range(len(clips))]
+    for name, clip in zip(names, clips):
+        audio_buffers.put(session_id, name, clip)
+    return names
+
 
 # Record audio
 audio = mic_recorder(
@@ -189,81 +266,211 @@ if audio:
     
     st.audio(audio_bytes, format="audio/wav")
 
+    # Stage results survive reruns, so a sidebar change only redoes affected stages
+    if "turn_cache" not in st.session_state:
+        st.session_state["turn_cache"] = TurnCache()
+    turn_cache: TurnCache = st.session_state["turn_cache"]
+    trace = start_turn(session_id)
+    # A new recording cancels whatever the session's previous turn still has in flight (barge-in)
+    turn = engine.begin_turn(session_id, trace.turn_id, recording=stage_key(audio_bytes))
+    # Requests are admitted fairly across sessions; while this one is queued, say where it stands
+    queue_box = st.empty()
+
+    def _show_queue():
+        waiting = engine.position(session_id)
+        if waiting is None:
+            queue_box.empty()
+        else:
+            service, place, wait_s = waiting
+            queue_box.caption(f"⏳ Busy right now: #{place} in line for {service.upper()}, about {wait_s:.0f} s")
+
     try:
         # --- Speech to text ---
-        with st.spinner("⏳ Transcribing your voice..."):
-            whisper_deployment = os.getenv("AZURE_OPENAI_WHISPER_DEPLOYMENT", "whisper")
-            try:
-                user_text = stt_client.audio.transcriptions.create(
-                    file=("audio.wav", audio_bytes),
-                    model=whisper_deployment
-                ).text
-            except Exception as stt_err:
-                st.error("Speech-to-text failed. Check that your Whisper deployment name and endpoint match.")
-                st.info(
-                    "Using endpoint: " + (os.getenv('AZURE_OPENAI_WHISPER_ENDPOINT') or os.getenv('AZURE_OPENAI_ENDPOINT', 'Not set'))
+        whisper_deployment = stt_pool.deployment
+        stt_prep = prep_settings()
+        seg_prep = segment_settings()
+        stt_key = stage_key(audio_bytes, whisper_deployment, stt_prep, seg_prep)
+        user_text = turn_cache.get("stt", stt_key)
+        if user_text is None:
+            with st.spinner("⏳ Transcribing your voice..."):
+                # Trim silence and downsample so the upload (and Whisper's work) is smaller
+                # Long recordings are split at pauses and the segments transcribed in parallel
+                with trace.stage("audio_prep") as rec:
+                    segments = segment_for_stt(audio_bytes, stt_prep, seg_prep)
+                    prepared = segments[0]
+                    upload_bytes = sum(len(p.data) for p in segments)
+                    rec.bytes_in, rec.bytes_out = len(audio_bytes), upload_bytes
+                st.caption(
+                    f"Upload: {len(audio_bytes) // 1024} KB → {upload_bytes // 1024} KB"
+                    f" ({(len(audio_bytes) - upload_bytes) * 100 // max(len(audio_bytes), 1)}% smaller,"
+                    f" {prepared.trimmed_ms} ms silence trimmed) in {prepared.elapsed_ms:.0f} ms"
+                    + (f" — {len(segments)} segments transcribed in parallel" if len(segments) > 1 else "")
+                    + (f" — {prepared.note}" if prepared.note and len(segments) == 1 else "")
                 )
-                raise stt_err
+                try:
+                    if len(segments) > 1:
+                        user_text = run_sync(engine.transcribe_segments(stt_pool, segments, trace), on_wait=_show_queue, turn=turn)
+                    else:
+                        user_text = run_sync(engine.transcribe(stt_pool, prepared, trace), on_wait=_show_queue, turn=turn)
+                except (Overloaded, TurnCancelled):
+                    raise
+                except Exception as stt_err:
+                    st.error("Speech-to-text failed. Check that your Whisper deployment name and endpoint match.")
+                    st.info(
+                        "Using endpoint: " + (os.getenv('AZURE_OPENAI_WHISPER_ENDPOINT') or os.getenv('AZURE_OPENAI_ENDPOINT', 'Not set'))
+                    )
+                    raise stt_err
+            turn_cache.put("stt", stt_key, user_text)
 
         st.success("**You said:**")
         st.write(user_text)
 
         # --- Language detection ---
-        detected_lang = detect_hi_en(user_text) if st.session_state.get("auto_lang", True) else 'en'
-        st.caption(f"Detected language: {'Hindi' if detected_lang=='hi' else 'English'}")
+        # Like the network stages, these run (and are timed) only when their inputs change
+        auto_lang = st.session_state.get("auto_lang", True)
+        lang_key = stage_key(user_text, auto_lang)
+        detected_lang = turn_cache.get("lang", lang_key)
+        if detected_lang is None:
+            with trace.stage("lang_detect"):
+                detected_lang = detect_language(user_text) if auto_lang else 'en'
+            turn_cache.put("lang", lang_key, detected_lang)
+        st.caption(f"Detected language: {LANGUAGE_NAMES[detected_lang]}")
 
         # --- LLM reply ---
-        with st.spinner("🤔 AI is thinking..."):
-            chat_deployment = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4")
-            # Apply smart memory to system prompt
-            mem = st.session_state.get("memory", {"preferred_name":"","speak_style":"normal"})
-            name_clause = f" Address the user as {mem['preferred_name']}." if mem.get("preferred_name") else ""
-            style_clause = {
-                "normal": "",
-                "slower": " Speak a bit slower and clearer.",
-                "faster": " Speak a bit faster and energetic."
-            }.get(mem.get("speak_style","normal"), "")
-            base_hint_hi = "You are a helpful voice assistant. Reply in Hindi. Keep responses concise and conversational."
-            base_hint_en = "You are a helpful voice assistant. Reply in English. Keep responses concise and conversational."
-            system_hint = (base_hint_hi if detected_lang=='hi' else base_hint_en) + name_clause + style_clause
-            reply_text = chat_client.chat.completions.create(
-                model=chat_deployment,
-                messages=[
-                    {"role": "system", "content": system_hint},
-                    {"role": "user", "content": user_text}
-                ]
-            ).choices[0].message.content
-
-        st.success("**AI Response:**")
-        st.write(reply_text)
-
-        # --- Text to speech ---
-        try:
-            with st.spinner("🔊 Generating voice response..."):
-                tts_deployment = os.getenv("AZURE_OPENAI_TTS_DEPLOYMENT", "tts")
-                reply_audio = tts_client.audio.speech.create(
-                    model=tts_deployment,
-                    voice=st.session_state.get("voice", "nova"),
-                    input=reply_text
-                ).read()
-
-            # Render cat avatar + audio; cat shows on play, hides on ended
-            render_cat_audio(reply_audio)
-        except Exception as tts_error:
-            st.warning("⚠️ Text-to-speech is not available yet. You can read the response above.")
-            st.info(f"TTS Error: {str(tts_error)[:160]}")
-            st.caption(
-                "Using endpoint: "
-                + (os.getenv("AZURE_OPENAI_TTS_ENDPOINT") or os.getenv("AZURE_OPENAI_ENDPOINT", "Not set"))
-                + " | API version: "
-                + (os.getenv("AZURE_OPENAI_TTS_API_VERSION") or os.getenv("AZURE_OPENAI_API_VERSION", "Not set"))
-                + " | Deployment: "
-                + (os.getenv("AZURE_OPENAI_TTS_DEPLOYMENT") or "tts")
-            )
-
+        chat_deployment = chat_pool.deployment
+        tts_deployment = tts_pool.deployment
+        voice = st.session_state.get("voice", "nova")
+        streaming = st.session_state.get("stream_reply", True)
+        # Apply smart memory to system prompt
+        mem = st.session_state.get("memory", {"preferred_name":"","speak_style":"normal"})
+        conversation: Conversation = st.session_state["conversation"]
+        use_history = st.session_state.get("use_history", True)
+        system_hint = build_system_hint(detected_lang, mem)
+        prompt_key = stage_key(system_hint, user_text, stt_key, use_history)
+        prompt = turn_cache.get("prompt", prompt_key)
+        if prompt is None:
+            with trace.stage("prompt_build") as rec:
+                if use_history:
+                    # Earlier turns (recent ones verbatim, older ones summarized) within a token budget
+                    messages = conversation.messages(system_hint, user_text, turn_key=stt_key)
+                else:
+                    messages = [
+                        {"role": "system", "content": system_hint},
+                        {"role": "user", "content": user_text}
+                    ]
+                rec.tokens_in = estimate_messages_tokens(messages)
+            prompt = (messages, rec.tokens_in)
+            turn_cache.put("prompt", prompt_key, prompt)
+        messages, prompt_tokens = prompt
+        if len(messages) > 2:
+            st.caption(f"🧠 Including {len(messages) - 2} earlier messages (~{prompt_tokens} prompt tokens)")
+        # The reply is cached as its list of spoken sentences (one item when not streaming).
+        # History is fixed for a given recording, so the clip (stt_key) stands in for it.
+        llm_key = stage_key(chat_deployment, system_hint, user_text, stt_key, use_history)
+        sentences = turn_cache.get("llm", llm_key)
+        reply_audio = None
+        turn_id = turn.turn_id
+        tts_cache = get_tts_cache()
+        # Repeated questions reuse an earlier reply (across sessions) and skip the chat call
+        reply_cache = get_reply_cache()
+        reply_key = None
+        if sentences is None and reply_cache is not None:
+            reply_key = reply_cache.key(chat_deployment, messages)
+            sentences = reply_cache.get(reply_key) if reply_key else None
+            if sentences is not None:
+                turn_cache.put("llm", llm_key, sentences)
+                if use_history:
+                    _remember_turn(conversation, stt_key, user_text, sentences, trace)
+                st.caption("⚡ Answered from the reply cache")
+
+        if sentences is None and streaming:
+            # --- Streamed reply: speak each sentence while the rest is generated ---
+            st.success("**AI Response:**")
+            reply_box = st.empty()
+            sentences, reply_audio = [], []
+            tts_failed = None
+            with st.spinner("🤔 AI is thinking..."):
+                for seg in iter_sync(engine.stream_reply_audio(chat_pool, tts_pool, voice, messages, tts_cache=tts_cache, trace=trace,
+                                                                 fmt=reply_format.name),
+                                     on_wait=_show_queue, turn=turn):
+                    sentences.append(seg.text)
+                    reply_audio.append(seg.audio)
+                    reply_box.write(" ".join(sentences))
+                    if seg.audio is not None:
+                        with trace.stage("render"):
+                            render_cat_audio_segment(turn_id, seg.index, seg.audio, mimetype=reply_format.mimetype)
+                    elif tts_failed is None:
+                        tts_failed = seg.error
+            turn_cache.put("llm", llm_key, sentences)
+            if reply_key:
+                reply_cache.put(reply_key, sentences)
+            if use_history:
+                _remember_turn(conversation, stt_key, user_text, sentences, trace)
+            if tts_failed is not None:
+                _show_tts_error(tts_failed)
+            else:
+                turn_cache.put("tts", stage_key(tts_deployment, voice, reply_format.name, sentences), _hold_reply_audio(reply_audio))
+        else:
+            if sentences is None:
+                with st.spinner("🤔 AI is thinking..."):
+                    reply_text = run_sync(engine.complete_chat(chat_pool, messages, trace), on_wait=_show_queue, turn=turn)
+                sentences = [reply_text]
+                turn_cache.put("llm", llm_key, sentences)
+                if reply_key:
+                    reply_cache.put(reply_key, sentences)
+                if use_history:
+                    _remember_turn(conversation, stt_key, user_text, sentences, trace)
+
+            st.success("**AI Response:**")
+            st.write(" ".join(sentences))
+
+            # --- Text to speech ---
+            tts_key = stage_key(tts_deployment, voice, reply_format.name, sentences)
+            reply_names = turn_cache.get("tts", tts_key)
+            # None if the clips were evicted from disk since; they are synthesized again (usually from the TTS cache)
+            reply_audio = audio_buffers.get_all(session_id, reply_names) if reply_names is not None else None
+            try:
+                synthesized = reply_audio is None
+                if synthesized:
+                    with st.spinner("🔊 Generating voice response..."):
+                        reply_audio = []
+                        for seg in run_sync(engine.synthesize_all(tts_pool, voice, sentences, tts_cache, trace, reply_format.name),
+                                            on_wait=_show_queue, turn=turn):
+                            if seg.error is not None:
+                                raise seg.error
+                            reply_audio.append(seg.audio)
+                    turn_cache.put("tts", tts_key, _hold_reply_audio(reply_audio))
+
+                # Render cat avatar + audio; cat shows on play, hides on ended
+                # (redrawing an earlier run's clips isn't timed as a render)
+                with trace.stage("render") if synthesized else nullcontext():
+                    if len(reply_audio) == 1:
+                        render_cat_audio(reply_audio[0], mimetype=reply_format.mimetype)
+                    else:
+                        for index, clip in enumerate(reply_audio):
+                            render_cat_audio_segment(turn_id, index, clip, mimetype=reply_format.mimetype)
+            except TurnCancelled:
+                raise
+            except Exception as tts_error:
+                _show_tts_error(tts_error)
+        note_turn(time.time() - trace.started)
+
+    except TurnCancelled:
+        # Superseded by a newer recording; that run renders the reply instead
+        pass
+    except Overloaded as e:
+        # Shed rather than queued indefinitely, so the requests already admitted still finish
+        st.warning(f"⏳ The assistant is busy right now ({e.service.upper()} is at capacity). "
+                   f"Please try again in about {max(1, round(e.retry_after_s))} s.")
     except Exception as e:
         st.error(f"❌ An error occurred: {str(e)}")
         st.info("Make sure your Azure OpenAI credentials are valid and your deployments are correctly configured in Azure Portal.")
+    finally:
+        queue_box.empty()
+        engine.end_turn(turn)
+        # A rerun answered entirely from the turn cache did no work worth a trace line
+        if trace.records:
+            trace.finish()
 
 # Sidebar with information
 with st.sidebar:
@@ -283,26 +490,37 @@ with st.sidebar:
     
     st.header("🎨 Voice Options")
     voices = ["nova", "alloy", "echo", "fable", "onyx", "shimmer"]
-    _default_voice = st.session_state.get("voice", "nova")
-    try:
-        _default_index = voices.index(_default_voice)
-    except ValueError:
-        _default_index = 0
-    selected_voice = st.selectbox("Select TTS voice", voices, index=_default_index)
-    st.session_state["voice"] = selected_voice
+    # Keyed, so the choice is in session state before the rerun it triggers reads it for the turn above
+    selected_voice = st.selectbox("Select TTS voice", voices, key="voice")
     st.write(f"Current voice: **{selected_voice.title()}**")
 
     st.header("🌐 Language")
-    auto_lang = st.checkbox("Auto-detect Hindi/English", value=True, key="auto_lang")
+    auto_lang = st.checkbox("Auto-detect reply language", value=True, key="auto_lang")
     st.caption("If enabled, the assistant will reply in the same language as your speech.")
 
+    st.header("⚡ Playback")
+    st.checkbox("Stream reply audio", value=True, key="stream_reply")
+    st.caption("Speak each sentence as soon as it is generated instead of waiting for the full reply.")
+    st.selectbox("Reply audio format", PREFERENCES, key="audio_format",
+                 index=PREFERENCES.index(_format_default) if _format_default in PREFERENCES else 0,
+                 format_func=lambda p: {"auto": "Auto (browser + connection)", "data-saver": "Data saver"}.get(p, p.upper()))
+    st.caption(f"Using **{reply_format.name.upper()}** (~{reply_format.nominal_kbps:g} kbps): {format_reason}. "
+               "Data saver picks the smallest format this browser plays, for mobile data.")
+
+    st.header("💬 Conversation")
+    st.checkbox("Remember earlier turns", value=True, key="use_history")
+    if st.button("Start new conversation"):
+        st.session_state["conversation"].clear()
+        audio_buffers.drop(session_id)
+        st.success("Conversation cleared.")
+
     st.header("🧠 Preferences (Memory)")
     mem = st.session_state["memory"]
     preferred_name = st.text_input("What should I call you?", value=mem.get("preferred_name", ""))
     speak_style = st.selectbox("Speaking style", ["normal", "slower", "faster"], index=["normal","slower","faster"].index(mem.get("speak_style","normal")))
     if st.button("Save preferences"):
         st.session_state["memory"] = {"preferred_name": preferred_name.strip(), "speak_style": speak_style}
-        save_memory(st.session_state["memory"]) 
+        prefs_store.set(st.session_state["user_id"], st.session_state["memory"])
         st.success("Preferences saved.")
     
     st.header("💡 Tips")
@@ -335,3 +553,99 @@ with st.sidebar:
         st.write("API Version:", os.getenv('AZURE_OPENAI_TTS_API_VERSION') or os.getenv('AZURE_OPENAI_API_VERSION', 'Not set'))
         st.write("Deployment:", os.getenv('AZURE_OPENAI_TTS_DEPLOYMENT') or 'tts')
         st.write("Key:", _mask(os.getenv('AZURE_OPENAI_TTS_API_KEY') or os.getenv('AZURE_OPENAI_API_KEY')))
+
+        st.markdown("**Connections**")
+        st.write("Shared client pools:", client_count())
+        for _svc, _load in engine.load().items():
+            st.write(f"{_svc.upper()}: {_load['active']} active / {_load['limit']} max, {_load['waiting']} queued"
+                     + (f", limited to {_load['rpm']:g} requests/min" if _load["rpm"] else "")
+                     + (f", {_load['tpm']:g} tokens/min" if _load["tpm"] else "")
+                     + f" | admitted {_load['admitted']}, shed {_load['rejected'] + _load['timed_out']}, throttled {_load['throttled']}")
+
+        st.write(f"Barge-in: {metrics.counter('turns_cancelled_total', 'barge_in'):g} turns interrupted"
+                 f" ({metrics.counter('turns_cancelled_total', 'rerun'):g} reruns) | cancelled calls: "
+                 + ", ".join(f"{_svc.upper()} {metrics.counter('cancelled_total', _svc):g}" for _svc in ("stt", "chat", "tts"))
+                 + f" | saved ~{metrics.counter('cancel_saved_total', 'chat', 'tokens'):g} chat tokens,"
+                 f" {metrics.counter('cancel_saved_total', 'tts', 'chars'):g} TTS characters"
+                 f" | {metrics.counter('segments_discarded_total'):g} clips discarded")
+
+        st.markdown("**Endpoints**")
+        for _svc, _pool in (("chat", chat_pool), ("stt", stt_pool), ("tts", tts_pool)):
+            st.caption(_svc.upper() + (f" (hedge after {_pool.hedge_after_s * 1000:.0f} ms)" if _pool.hedge_after_s else ""))
+            st.table(_pool.stats())
+
+        st.markdown("**Warm-up**")
+        _warmup = get_warmup()
+        if _warmup is None:
+            st.write("Disabled (WARMUP_ENABLED=0)")
+        else:
+            st.write(f"State: {_warmup.state}, {_warmup.rounds} rounds"
+                     + (f" | initial warm-up took {(_warmup.finished_at - _warmup.started_at) * 1000:.0f} ms" if _warmup.finished_at else "")
+                     + (f" | refresh every {_warmup.refresh_s:g} s while idle" if _warmup.refresh_s > 0 else ""))
+            if _warmup.first:
+                st.table(_warmup.snapshot())
+        _first = first_turn()
+        if _first is not None:
+            st.write(f"First turn on this server: {_first['seconds'] * 1000:.0f} ms ({_first['kind']})")
+        else:
+            st.write("First turn on this server: not yet")
+
+        st.markdown("**TTS cache**")
+        _tts_cache = get_tts_cache()
+        if _tts_cache is None:
+            st.write("Disabled (TTS_CACHE_ENABLED=0)")
+        else:
+            _tc = _tts_cache.snapshot()
+            _lookups = _tc["memory_hits"] + _tc["disk_hits"] + _tc["misses"] + _tc["coalesced"]
+            _hit_rate = (_lookups - _tc["misses"]) / _lookups if _lookups else 0.0
+            st.write(f"Hits: {_tc['memory_hits']} memory, {_tc['disk_hits']} disk, {_tc['coalesced']} coalesced | Misses: {_tc['misses']} | Hit rate: {_hit_rate:.0%}")
+            st.write(f"Size: {_tc['memory_entries']} clips / {_tc['memory_bytes'] // 1024} KB in memory, {_tc['disk_bytes'] // 1024} KB on disk")
+
+        st.markdown("**Stage memo (this session)**")
+        _memo = st.session_state.get("turn_cache")
+        if _memo is None:
+            st.write("No recording yet.")
+        else:
+            _memo_lookups = _memo.hits + _memo.misses
+            st.write(f"Reused: {_memo.hits} | Recomputed: {_memo.misses}"
+                     f" | Reuse rate: {_memo.hits / _memo_lookups if _memo_lookups else 0.0:.0%}")
+
+        st.markdown("**Reply audio format**")
+        _ua = _client_headers().get("user-agent", "")
+        st.write(f"{reply_format.name.upper()} ({reply_format.mimetype}): {format_reason}"
+                 + (f" | browser: {_ua[:80]}" if _ua else " | browser: unknown"))
+
+        st.markdown("**Audio memory**")
+        _au = audio_buffers.usage(session_id)
+        _ab = audio_buffers.snapshot()
+        st.write(f"This session: {_au['clips']} clips, {_au['memory_bytes'] // 1024} KB in memory, {_au['spilled_bytes'] // 1024} KB spilled"
+                 f" (budget {audio_buffers.session_budget // 1024} KB)" + (f" | current recording {len(audio_bytes) // 1024} KB" if audio else ""))
+        st.write(f"Server: {_ab['sessions']} sessions, {_ab['memory_bytes'] // 1024} KB in memory (budget {audio_buffers.global_budget >> 20} MB),"
+                 f" {_ab['spilled_bytes'] // 1024} KB spilled | {_ab['spills']} spills, {_ab['evictions']} evictions, {_ab['disk_reads']} disk reads, {_ab['expired']} sessions expired"
+                 f" | Process RSS: {process_rss_bytes() >> 20} MB")
+
+        st.markdown("**Reply cache**")
+        _reply_cache = get_reply_cache()
+        if _reply_cache is None:
+            st.write("Disabled (REPLY_CACHE_ENABLED=0)")
+        else:
+            _rc = _reply_cache.snapshot()
+            st.write(f"Hits: {_rc['hits']} | Misses: {_rc['misses']} ({_rc['expired']} expired) | Bypassed: {_rc['bypassed']} | Hit rate: {_rc['hit_rate']:.0%}")
+            st.write(f"Entries: {_rc['entries']} / {_reply_cache.max_entries}, TTL {_reply_cache.ttl_s:g} s")
+
+        st.markdown("**Conversation (this session)**")
+        _cv = st.session_state["conversation"].snapshot()
+        st.write(f"Verbatim turns: {_cv['turns']} (~{_cv['turn_tokens']} tokens) | Summary: ~{_cv['summary_tokens']} tokens, {_cv['folds']} folds ({_cv['fallback_folds']} local)" + (" | summarizing…" if _cv["folding"] else ""))
+        st.write(f"Last prompt: ~{_cv['last_prompt_tokens']} tokens (history budget {st.session_state['conversation'].budget_tokens})")
+
+        st.markdown("**Preference store**")
+        _ps = prefs_store.stats
+        st.write(f"{type(prefs_store).__name__}: {_ps['reads']} reads ({_ps['cache_hits']} cached), {_ps['writes']} writes in {_ps['batches']} batches"
+                 + (f" | {_ps['write_errors']} write errors, last: {prefs_store.last_error}" if _ps["write_errors"] else ""))
+
+        st.markdown("**Stage latency (this server)**")
+        _rows = metrics.summary()
+        if _rows:
+            st.table(_rows)
+        else:
+            st.write("No turns recorded yet.")
@@ -0,0 +1,273 @@
+"""
+Byte-budgeted store for the audio clips sessions keep between reruns.
+
+Every session holds on to its latest reply clips so a rerun can replay them
+without calling TTS again. Kept as plain ``bytes`` in session state, that
+memory grows with users × clip size and is only released when a session
+expires. ``AudioBufferManager`` keeps clips in memory within a per-session
+and a process-wide byte budget; past either budget the least recently used
+clips are spilled to temp files, and re-read through ``mmap`` (straight from
+the page cache) when needed. Spilled clips beyond the disk budget are
+deleted, least recently used first, and ``get`` then reports a miss so the
+caller regenerates the clip (usually from the TTS cache).
+
+A clip read back from disk is taken into memory again (within the budgets),
+so the bytes the page is playing are always the ones counted here: Streamlit's
+in-memory media storage keeps a reference to the same ``bytes`` object rather
+than a copy. Sessions that Streamlit has closed or disconnected, or that have
+been idle past the TTL, are swept out every ``sweep_interval_s``.
+"""
+import atexit
+import time
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from settings import get_env_or_secret, get_number
+
+
+@dataclass
+class _Clip:
+    session: str
+    size: int
+    data: bytes | None = None  # None once spilled
+    path: str | None = None
+
+
+class AudioBufferManager:
+    """LRU clip store with per-session and global memory budgets and a disk spill."""
+
+    def __init__(self, session_budget: int = 4 << 20, global_budget: int = 256 << 20,
+                 spill_budget: int = 1 << 30, spill_dir: str | None = None, idle_ttl_s: float = 1800,
+                 session_alive: Callable[[str], bool] | None = None, sweep_interval_s: float = 30):
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self.spill_budget = spill_budget
+        # Sessions unused this long, or that ``session_alive`` says are gone, lose their clips
+        self.idle_ttl_s = idle_ttl_s
+        self.session_alive = session_alive
+        self.sweep_interval_s = sweep_interval_s
+        self._last_used: dict[str, float] = {}
+        self._next_sweep = time.monotonic() + sweep_interval_s
+        self._spill_root = spill_dir
+        self._spill_dir: str | None = None
+        self._clips: OrderedDict[tuple[str, str], _Clip] = OrderedDict()
+        self._session_memory: dict[str, int] = {}
+        self._session_spilled: dict[str, int] = {}
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+        self.stats = {"puts": 0, "hits": 0, "disk_reads": 0, "misses": 0, "spills": 0, "evictions": 0, "expired": 0}
+        self._lock = threading.Lock()
+
+    # --- Public API ---
+    def put(self, session: str, name: str, data: bytes) -> None:
+        """Keep ``data`` as the session's clip ``name`` (replacing any earlier one)."""
+        self._maybe_sweep()
+        with self._lock:
+            self._last_used[session] = time.monotonic()
+            self._remove((session, name))
+            self._clips[(session, name)] = _Clip(session, len(data), data)
+            self._account(session, len(data), 0)
+            self.stats["puts"] += 1
+            self._enforce(session)
+
+    def get(self, session: str, name: str) -> bytes | None:
+        """The clip's bytes, read back from disk if it was spilled; None if it is gone."""
+        self._maybe_sweep()
+        with self._lock:
+            self._last_used[session] = time.monotonic()
+            clip = self._clips.get((session, name))
+            if clip is None:
+                self.stats["misses"] += 1
+                return None
+            self._clips.move_to_end((session, name))
+            if clip.data is not None:
+                self.stats["hits"] += 1
+                return clip.data
+            path = clip.path
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                data = m[:]
+        except (OSError, ValueError):
+            with self._lock:
+                self._remove((session, name))
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["disk_reads"] += 1
+            # Back in memory and counted, since the caller is about to hold (and serve) these bytes;
+            # the budgets then spill something else, least recently used first
+            if self._clips.get((session, name)) is clip and clip.data is None:
+                self._account(session, clip.size, -clip.size)
+                clip.data, path = data, clip.path
+                clip.path = None
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                self._enforce(session)
+        return data
+
+    def get_all(self, session: str, names: list[str]) -> list[bytes] | None:
+        """All of ``names`` in order, or None if any of them is gone."""
+        clips = [self.get(session, name) for name in names]
+        return None if any(clip is None for clip in clips) else clips
+
+    def drop(self, session: str, prefix: str = "") -> None:
+        """Forget the session's clips whose names start with ``prefix`` (all by default)."""
+        with self._lock:
+            for key in [k for k in self._clips if k[0] == session and k[1].startswith(prefix)]:
+                self._remove(key)
+
+    def sweep(self) -> int:
+        """Drop the clips of sessions that are gone or idle past the TTL; returns how many sessions."""
+        now = time.monotonic()
+        with self._lock:
+            self._next_sweep = now + self.sweep_interval_s
+            sessions = {key[0] for key in self._clips}
+            idle = {s for s in sessions if now - self._last_used.get(s, now) > self.idle_ttl_s}
+            for session in set(self._last_used) - sessions:
+                del self._last_used[session]
+        # Outside the lock: the liveness check asks the Streamlit runtime
+        gone = idle | {s for s in sessions - idle if self.session_alive is not None and not self.session_alive(s)}
+        with self._lock:
+            for session in gone:
+                for key in [k for k in self._clips if k[0] == session]:
+                    self._remove(key)
+                self._last_used.pop(session, None)
+            self.stats["expired"] += len(gone)
+        return len(gone)
+
+    def usage(self, session: str) -> dict:
+        with self._lock:
+            return {
+                "clips": sum(1 for key in self._clips if key[0] == session),
+                "memory_bytes": self._session_memory.get(session, 0),
+                "spilled_bytes": self._session_spilled.get(session, 0),
+            }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "clips": len(self._clips),
+                "sessions": len({key[0] for key in self._clips}),
+                "memory_bytes": self.memory_bytes,
+                "spilled_bytes": self.spilled_bytes,
+            }
+
+    # --- Internals (call with the lock held, except _maybe_sweep) ---
+    def _maybe_sweep(self) -> None:
+        if time.monotonic() >= self._next_sweep:
+            self.sweep()
+
+    def _account(self, session: str, memory: int, spilled: int) -> None:
+        self.memory_bytes += memory
+        self.spilled_bytes += spilled
+        self._session_memory[session] = self._session_memory.get(session, 0) + memory
+        self._session_spilled[session] = self._session_spilled.get(session, 0) + spilled
+        for table in (self._session_memory, self._session_spilled):
+            if not table[session]:
+                del table[session]
+
+    def _remove(self, key: tuple[str, str]) -> None:
+        clip = self._clips.pop(key, None)
+        if clip is None:
+            return
+        if clip.data is not None:
+            self._account(clip.session, -clip.size, 0)
+        else:
+            self._account(clip.session, 0, -clip.size)
+            try:
+                os.remove(clip.path)
+            except OSError:
+                pass
+
+    def _spill(self, key: tuple[str, str], clip: _Clip) -> None:
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="voice-agent-audio-", dir=self._spill_root)
+            atexit.register(shutil.rmtree, self._spill_dir, True)
+        path = os.path.join(self._spill_dir, uuid.uuid4().hex)
+        try:
+            with open(path, "wb") as f:
+                f.write(clip.data)
+        except OSError:
+            # No room on disk: drop the clip rather than go over the memory budget
+            self._remove(key)
+            self.stats["evictions"] += 1
+            return
+        clip.data, clip.path = None, path
+        self._account(clip.session, -clip.size, clip.size)
+        self.stats["spills"] += 1
+
+    def _enforce(self, session: str) -> None:
+        # Oldest first: the dict is kept in least-recently-used order
+        for key, clip in list(self._clips.items()):
+            over_session = self._session_memory.get(session, 0) > self.session_budget
+            if not over_session and self.memory_bytes <= self.global_budget:
+                break
+            if clip.data is not None and (self.memory_bytes > self.global_budget or key[0] == session):
+                self._spill(key, clip)
+        for key, clip in list(self._clips.items()):
+            if self.spilled_bytes <= self.spill_budget:
+                break
+            if clip.data is None:
+                self._remove(key)
+                self.stats["evictions"] += 1
+
+
+def streamlit_session_alive(session: str) -> bool:
+    """False once Streamlit has closed or disconnected the session; True outside a Streamlit server."""
+    try:
+        from streamlit import runtime
+
+        if not runtime.exists() or not session:
+            return True
+        return runtime.get_instance().is_active_session(session)
+    except Exception:
+        return True
+
+
+_manager: AudioBufferManager | None = None
+_manager_lock = threading.Lock()
+
+
+def get_audio_buffers() -> AudioBufferManager:
+    """Process-wide manager sized by AUDIO_SESSION_BUDGET_KB / AUDIO_MEMORY_BUDGET_MB / AUDIO_SPILL_BUDGET_MB,
+    expiring sessions after AUDIO_SESSION_IDLE_MIN or once Streamlit drops them."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = AudioBufferManager(
+                    session_budget=int(get_number("AUDIO_SESSION_BUDGET_KB", 4096) * 1024),
+                    global_budget=int(get_number("AUDIO_MEMORY_BUDGET_MB", 256) * 1024 * 1024),
+                    spill_budget=int(get_number("AUDIO_SPILL_BUDGET_MB", 1024) * 1024 * 1024),
+                    spill_dir=get_env_or_secret("AUDIO_SPILL_DIR") or None,
+                    idle_ttl_s=get_number("AUDIO_SESSION_IDLE_MIN", 30) * 60,
+                    session_alive=streamlit_session_alive,
+                )
+    return _manager
+
+
+def process_rss_bytes() -> int:
+    """Current resident set size of this process (0 where it can't be read)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+
+        # Peak rather than current on platforms without /proc; KB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except Exception:
+        return 0
@@ -0,0 +1,118 @@
+"""
+Choose the TTS output format per client.
+
+The speech API can return Opus, AAC, MP3 or raw PCM; it has no bitrate
+setting, so the format is the size lever. ``negotiate`` picks one from what
+the browser's ``<audio>`` element can play (by User-Agent) and a bandwidth
+class: "low" for Data Saver / slow connections / mobile, "high" for fast
+links, "normal" otherwise. Low gets the most compact codec the browser
+supports; normal and high keep MP3. PCM (about six times MP3's size, and
+the clips are also held in memory under ``audio_buffers``' budgets) is only
+used when chosen explicitly. The bandwidth class comes from client hints
+(``Save-Data``, ``ECT``, ``Downlink``; the last two are only sent when a
+proxy in front of the app sets ``Accept-CH: ECT, Downlink``) or the user's
+choice in the sidebar.
+"""
+import io
+import wave
+from collections.abc import Mapping
+from dataclasses import dataclass
+
+# The service's "pcm" output: 24 kHz, 16-bit little-endian, mono
+PCM_RATE = 24000
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    name: str  # the speech API's response_format
+    mimetype: str
+    extension: str
+    # Rough size of speech in this format; only used for estimates and by the mock (measure with bench_tts_formats.py)
+    nominal_kbps: float
+
+    def playable(self, data: bytes) -> bytes:
+        """The API's bytes in a container browsers play: raw PCM gets a WAV header."""
+        if self.name != "pcm":
+            return data
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(PCM_RATE)
+            w.writeframes(data)
+        return buf.getvalue()
+
+
+FORMATS = {
+    "opus": AudioFormat("opus", "audio/ogg; codecs=opus", "opus", 32),
+    "aac": AudioFormat("aac", "audio/aac", "aac", 48),
+    "mp3": AudioFormat("mp3", "audio/mpeg", "mp3", 64),
+    "pcm": AudioFormat("pcm", "audio/wav", "wav", PCM_RATE * 16 / 1000),
+}
+# Sidebar / TTS_FORMAT choices besides the format names themselves
+PREFERENCES = ("auto", "data-saver", *FORMATS)
+# Most compact first; what "low" bandwidth gets, subject to browser support
+COMPACT_ORDER = ("opus", "aac", "mp3")
+
+
+def _headers(headers: Mapping[str, str] | None) -> dict[str, str]:
+    return {k.lower(): v for k, v in (headers or {}).items()}
+
+
+def browser_formats(user_agent: str) -> tuple[str, ...]:
+    """Formats the browser's ``<audio>`` element can play, going by its User-Agent."""
+    ua = user_agent or ""
+    if not ua:
+        return ("mp3", "pcm")
+    # Every iOS browser is WebKit; desktop Safari says "Safari" without "Chrome"
+    webkit = any(token in ua for token in ("iPhone", "iPad", "iPod")) or (
+        "Safari" in ua and not any(token in ua for token in ("Chrome", "Chromium", "Edg", "OPR", "Android")))
+    if webkit:
+        # Safari has no reliable Ogg Opus playback; ADTS AAC and MP3 are native
+        return ("aac", "mp3", "pcm")
+    if "Firefox" in ua or any(token in ua for token in ("Chrome", "Chromium", "Edg", "OPR")):
+        return ("opus", "aac", "mp3", "pcm")
+    return ("mp3", "pcm")
+
+
+def bandwidth_class(headers: Mapping[str, str] | None) -> tuple[str, str]:
+    """("low" | "normal" | "high", the reason) from client hints and the User-Agent."""
+    h = _headers(headers)
+    if h.get("save-data", "").strip().lower() == "on":
+        return "low", "Save-Data"
+    ect = h.get("ect", "").strip().lower()
+    if ect in ("slow-2g", "2g", "3g"):
+        return "low", f"ECT {ect}"
+    try:
+        downlink = float(h.get("downlink", ""))
+    except ValueError:
+        downlink = None
+    if downlink is not None:
+        if downlink < 1.5:
+            return "low", f"downlink {downlink:g} Mbps"
+        if downlink >= 10:
+            return "high", f"downlink {downlink:g} Mbps"
+        return "normal", f"downlink {downlink:g} Mbps"
+    if h.get("sec-ch-ua-mobile", "").strip() == "?1" or "Mobi" in h.get("user-agent", ""):
+        return "low", "mobile"
+    return "normal", "default"
+
+
+def negotiate(preference: str, headers: Mapping[str, str] | None) -> tuple[AudioFormat, str]:
+    """The reply format for this client, and why it was chosen.
+
+    ``preference`` is "auto", "data-saver" or a format name; a format the
+    browser can't play falls back to the automatic choice.
+    """
+    supported = browser_formats(_headers(headers).get("user-agent", ""))
+    if preference in FORMATS and preference in supported:
+        return FORMATS[preference], "chosen"
+    if preference == "data-saver":
+        klass, reason = "low", "data saver"
+    else:
+        klass, reason = bandwidth_class(headers)
+        if preference in FORMATS:
+            reason = f"{preference} not supported by this browser; {reason}"
+    # Fast links don't get PCM: it would only cost download and the server's clip memory
+    name = next(fmt for fmt in COMPACT_ORDER if fmt in supported) if klass == "low" else "mp3"
+    return FORMATS[name], f"{klass} bandwidth ({reason})"
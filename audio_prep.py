@@ -0,0 +1,177 @@
+"""
+Pre-process recordings before they are uploaded to Whisper.
+
+The browser hands over whatever it captured (often 44.1/48 kHz stereo with
+silence at both ends). Trimming the silence, downmixing to mono and
+resampling to 16 kHz (Whisper's native rate) shrinks the upload and the audio
+Whisper has to process. Anything that can't be decoded is passed through
+unchanged. Long recordings can also be split at pauses into segments that
+are transcribed in parallel.
+"""
+import io
+import time
+import wave
+from dataclasses import dataclass
+
+from settings import get_env_or_secret, get_number
+from vad import split_speech
+
+TARGET_RATE = 16000
+# Codecs other than wav need ffmpeg; the upload filename's extension tells
+# Whisper which format it is receiving
+_EXPORT_ARGS = {
+    "wav": {"format": "wav"},
+    "flac": {"format": "flac"},
+    "mp3": {"format": "mp3", "bitrate": "32k"},
+    "ogg": {"format": "ogg", "codec": "libopus", "bitrate": "24k"},
+}
+
+
+@dataclass
+class PreparedAudio:
+    data: bytes
+    filename: str
+    original_bytes: int
+    trimmed_ms: int = 0
+    elapsed_ms: float = 0.0
+    note: str = ""
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_bytes - len(self.data)
+
+
+def prep_settings() -> tuple:
+    """Settings that change the prepared audio; part of the STT cache key."""
+    return (
+        (get_env_or_secret("STT_PREPROCESS", "1") or "1").lower() not in ("0", "false", "no"),
+        (get_env_or_secret("STT_UPLOAD_FORMAT", "wav") or "wav").lower(),
+        get_number("STT_SILENCE_THRESHOLD_DB", 16),
+        get_number("STT_SILENCE_PADDING_MS", 200),
+    )
+
+
+def segment_settings() -> tuple:
+    """Settings for splitting long recordings; part of the STT cache key."""
+    return (
+        get_number("STT_SEGMENT_MIN_S", 15),
+        get_number("STT_SEGMENT_TARGET_S", 6),
+        get_number("STT_SEGMENT_MAX_S", 25),
+        get_number("STT_SEGMENT_PAUSE_MS", 400),
+    )
+
+
+def _decode(audio_bytes: bytes):
+    from pydub import AudioSegment
+
+    # WAV decodes natively; other containers (webm/ogg) are probed with ffmpeg
+    fmt_hint = "wav" if audio_bytes[:4] == b"RIFF" else None
+    sound = AudioSegment.from_file(io.BytesIO(audio_bytes), format=fmt_hint)
+    return sound.set_channels(1).set_frame_rate(TARGET_RATE).set_sample_width(2)
+
+
+def pcm_to_wav(pcm: bytes, rate: int = TARGET_RATE) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm)
+    return buf.getvalue()
+
+
+def segment_for_stt(audio_bytes: bytes, settings: tuple | None = None,
+                    seg_settings: tuple | None = None) -> list[PreparedAudio]:
+    """Split a long recording at pauses into 16 kHz mono WAV segments.
+
+    Recordings shorter than ``STT_SEGMENT_MIN_S`` (or that can't be decoded,
+    or have no pause to split at) come back as one ``prepare_for_stt`` result.
+    """
+    enabled, _, threshold_db, padding_ms = settings or prep_settings()
+    min_s, target_s, max_s, pause_ms = seg_settings or segment_settings()
+    started = time.perf_counter()
+    if enabled and min_s > 0:
+        try:
+            sound = _decode(audio_bytes)
+        except Exception:
+            sound = None
+        if sound is not None and len(sound) >= min_s * 1000:
+            segments = split_speech(
+                sound.raw_data, TARGET_RATE, threshold_db=threshold_db, min_silence_ms=int(pause_ms),
+                min_segment_ms=int(target_s * 1000), max_segment_ms=int(max_s * 1000), padding_ms=int(padding_ms),
+            )
+            if len(segments) > 1:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                voiced_ms = sum(seg.duration_ms for seg in segments)
+                return [
+                    PreparedAudio(
+                        data=pcm_to_wav(seg.pcm),
+                        filename=f"segment-{seg.index}.wav",
+                        # Attribute the original size and trimmed silence to the first segment
+                        original_bytes=len(audio_bytes) if seg.index == 0 else 0,
+                        trimmed_ms=max(len(sound) - voiced_ms, 0) if seg.index == 0 else 0,
+                        elapsed_ms=elapsed_ms,
+                        note=f"segment {seg.index + 1}/{len(segments)} at {seg.start_ms / 1000:.1f}s",
+                    )
+                    for seg in segments
+                ]
+    return [prepare_for_stt(audio_bytes, settings)]
+
+
+def prepare_for_stt(audio_bytes: bytes, settings: tuple | None = None) -> PreparedAudio:
+    """Trim silence, downmix and resample a recording for upload."""
+    enabled, fmt, threshold_db, padding_ms = settings or prep_settings()
+    started = time.perf_counter()
+    passthrough = PreparedAudio(audio_bytes, "audio.wav", len(audio_bytes))
+    if not enabled:
+        return passthrough
+    try:
+        from pydub.silence import detect_leading_silence
+
+        sound = _decode(audio_bytes)
+    except Exception as e:
+        passthrough.note = f"not decoded ({type(e).__name__}); sent as recorded"
+        passthrough.elapsed_ms = (time.perf_counter() - started) * 1000
+        return passthrough
+
+    # Energy-based trim: anything quieter than the clip's average loudness minus
+    # threshold_db counts as silence. Leave some padding so word edges survive.
+    if sound.dBFS != float("-inf"):
+        silence_thresh = max(sound.dBFS - threshold_db, -60.0)
+        lead = detect_leading_silence(sound, silence_threshold=silence_thresh, chunk_size=10)
+        tail = detect_leading_silence(sound.reverse(), silence_threshold=silence_thresh, chunk_size=10)
+        start = max(0, lead - int(padding_ms))
+        end = min(len(sound), len(sound) - tail + int(padding_ms))
+        # An all-silent clip would trim to nothing; keep it whole instead
+        if end - start > padding_ms * 2:
+            trimmed_ms = len(sound) - (end - start)
+            sound = sound[start:end]
+        else:
+            trimmed_ms = 0
+    else:
+        trimmed_ms = 0
+
+    note = ""
+    export_fmt = fmt if fmt in _EXPORT_ARGS else "wav"
+    buf = io.BytesIO()
+    try:
+        sound.export(buf, **_EXPORT_ARGS[export_fmt])
+    except Exception as e:
+        # Compressed codecs need ffmpeg; plain 16 kHz mono wav never does
+        note = f"{export_fmt} export failed ({type(e).__name__}); sent wav"
+        export_fmt = "wav"
+        buf = io.BytesIO()
+        sound.export(buf, format="wav")
+    data = buf.getvalue()
+    if len(data) >= len(audio_bytes):
+        passthrough.note = "re-encoding did not shrink the clip; sent as recorded"
+        passthrough.elapsed_ms = (time.perf_counter() - started) * 1000
+        return passthrough
+    return PreparedAudio(
+        data=data,
+        filename=f"audio.{export_fmt}",
+        original_bytes=len(audio_bytes),
+        trimmed_ms=trimmed_ms,
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+        note=note,
+    )
@@ -0,0 +1,266 @@
+"""
+Run recorded calls through the voice pipeline headlessly.
+
+Each recording goes through ``VoiceEngine.run_turn`` (the same Whisper →
+chat → TTS code, including language detection, that the app uses) on the
+shared engine loop. ``--workers`` turns run at once, and every service is
+held to its own concurrency cap and requests-per-minute quota, so throughput
+grows with the worker count until a quota is the bottleneck. Inputs are
+streamed from a directory (recursively) or a manifest, results are appended
+to ``<out>/results.jsonl`` and reply audio is written to ``<out>/audio/``:
+
+    python batch.py recordings/ --out runs/qa --workers 16 --rpm chat=600 --rpm tts=150
+    python batch.py manifest.jsonl --out runs/prompts --voice alloy
+
+A manifest is a text file with one path per line, or JSONL with ``path`` and
+optional ``id``, ``voice`` and ``lang`` ("auto" or "en") per line. Completed
+ids are appended to a checkpoint file, so re-running the same command skips
+them; failed items, and partial ones (some reply audio missing), are logged
+but not checkpointed, so they are retried, and make the run exit with 1.
+``--mock`` runs against an in-process mock server instead of Azure: every
+service's pool points at it, whatever endpoints and keys are configured, and
+the shared TTS cache is left alone.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+from metrics import Metrics, TurnTrace
+from mock_azure import add_config_args, config_from_args, start_mock_server
+
+AUDIO_SUFFIXES = {".wav", ".mp3", ".m4a", ".mp4", ".webm", ".ogg", ".oga", ".flac", ".mpga", ".mpeg"}
+
+
+@dataclass
+class BatchItem:
+    id: str
+    path: Path
+    voice: str | None = None
+    auto_lang: bool = True
+
+
+def iter_items(source: Path) -> Iterator[BatchItem]:
+    """Recordings under a directory, or the entries of a manifest, one at a time."""
+    if source.is_dir():
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                path = Path(root) / name
+                if path.suffix.lower() in AUDIO_SUFFIXES:
+                    yield BatchItem(path.relative_to(source).with_suffix("").as_posix(), path)
+        return
+    base = source.parent
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                path = base / entry["path"]
+                yield BatchItem(str(entry.get("id") or Path(entry["path"]).with_suffix("").as_posix()), path,
+                                entry.get("voice"), entry.get("lang", "auto") != "en")
+            else:
+                yield BatchItem(Path(line).with_suffix("").as_posix(), base / line)
+
+
+def read_checkpoint(path: Path) -> set[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+    except OSError:
+        return set()
+
+
+def _parse_limits(specs: list[str], flag: str) -> dict[str, float]:
+    limits = {}
+    for spec in specs:
+        service, _, value = spec.partition("=")
+        if service not in ("stt", "chat", "tts") or not value:
+            raise SystemExit(f"{flag} expects stt=N, chat=N or tts=N, got {spec!r}")
+        limits[service] = float(value)
+    return limits
+
+
+async def run_batch(engine, pools: dict, items: Iterator[BatchItem], out_dir: Path, workers: int,
+                    voice: str, done_ids: set[str], registry: Metrics,
+                    write_audio: bool = True, tts_cache=None, progress=print) -> dict:
+    results_path = out_dir / "results.jsonl"
+    checkpoint_path = out_dir / "checkpoint.txt"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    outcome = {"ok": 0, "partial": 0, "failed": 0, "skipped": 0, "audio_bytes": 0}
+    # Bounded so a huge directory is streamed rather than listed up front
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    results = open(results_path, "a", encoding="utf-8")
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8")
+
+    async def _feed():
+        for item in items:
+            if item.id in done_ids:
+                outcome["skipped"] += 1
+                continue
+            await queue.put(item)
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def _process(item: BatchItem) -> dict:
+        trace = TurnTrace(registry, session_id=f"batch:{item.id}")
+        t0 = time.perf_counter()
+        row = {"id": item.id, "source": str(item.path)}
+        try:
+            audio_bytes = await asyncio.to_thread(item.path.read_bytes)
+            # Each recording is an independent single-turn call: no conversation history
+            result = await engine.run_turn(pools, audio_bytes, voice=item.voice or voice, auto_lang=item.auto_lang,
+                                           tts_cache=tts_cache, trace=trace)
+        except Exception as e:
+            row.update(status="error", error=f"{type(e).__name__}: {str(e)[:300]}")
+        else:
+            clips = [clip for clip in result.audio if clip]
+            row.update(
+                status="ok" if not result.errors else "partial",
+                transcript=result.transcript,
+                language=result.language,
+                reply=" ".join(result.sentences),
+                sentences=result.sentences,
+                tts_errors=[f"{type(e).__name__}: {str(e)[:200]}" for e in result.errors],
+            )
+            if write_audio and clips:
+                audio_path = out_dir / "audio" / f"{item.id}.mp3"
+                # MP3 frames concatenate cleanly, so the sentence clips make one file
+                data = b"".join(clips)
+                await asyncio.to_thread(_write_bytes, audio_path, data)
+                row["audio"] = audio_path.relative_to(out_dir).as_posix()
+                outcome["audio_bytes"] += len(data)
+        timings: dict[str, float] = {}
+        for rec in trace.records:
+            timings[rec.stage] = round(timings.get(rec.stage, 0.0) + rec.seconds * 1000, 1)
+        row["timings_ms"] = timings
+        row["total_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        registry.observe("item", time.perf_counter() - t0)
+        return row
+
+    async def _worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            row = await _process(item)
+            results.write(json.dumps(row, ensure_ascii=False) + "\n")
+            results.flush()
+            if row["status"] == "error":
+                outcome["failed"] += 1
+            elif row["status"] == "partial":
+                # Some reply audio is missing: leave it out of the checkpoint so a re-run regenerates it
+                outcome["partial"] += 1
+            else:
+                # Only after its result line is on disk does an item count as done
+                checkpoint.write(item.id + "\n")
+                checkpoint.flush()
+                outcome["ok"] += 1
+            if progress:
+                progress(f"[{outcome['ok'] + outcome['partial'] + outcome['failed']}] {row['status']:<7} {item.id} ({row['total_ms']:.0f} ms)"
+                         + (f" — {row['error']}" if row["status"] == "error" else ""))
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(_feed(), *(_worker() for _ in range(workers)))
+    finally:
+        results.close()
+        checkpoint.close()
+    outcome["seconds"] = time.perf_counter() - started
+    return outcome
+
+
+def _write_bytes(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def main(argv: list[str] | None = None) -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("source", type=Path, help="directory of recordings, or a manifest (.txt/.jsonl)")
+    parser.add_argument("--out", type=Path, required=True, help="output directory (results.jsonl, audio/, checkpoint.txt)")
+    parser.add_argument("--workers", type=int, default=8, help="recordings processed at once")
+    parser.add_argument("--rpm", action="append", default=[], metavar="SERVICE=N",
+                        help="requests per minute for stt, chat or tts (repeatable; default ENGINE_RPM_<SERVICE>)")
+    parser.add_argument("--tpm", action="append", default=[], metavar="SERVICE=N",
+                        help="estimated tokens per minute for chat (repeatable; default ENGINE_TPM_<SERVICE>)")
+    parser.add_argument("--concurrency", action="append", default=[], metavar="SERVICE=N",
+                        help="requests in flight for stt, chat or tts (repeatable; default ENGINE_MAX_CONCURRENT_<SERVICE>)")
+    parser.add_argument("--voice", default="nova")
+    parser.add_argument("--no-audio", action="store_true", help="don't write reply audio")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and process everything again")
+    parser.add_argument("--quiet", action="store_true", help="don't print a line per item")
+    parser.add_argument("--mock", action="store_true", help="run against an in-process mock server")
+    add_config_args(parser)
+    args = parser.parse_args(argv)
+    if not args.source.exists():
+        parser.error(f"{args.source} does not exist")
+
+    server = start_mock_server(config_from_args(args)) if args.mock else None
+    # Every worker can hold an STT upload, a chat stream and several TTS requests at once
+    os.environ.setdefault("AZURE_OPENAI_MAX_CONNECTIONS", str(max(100, args.workers * 6)))
+    # Batch items queue behind the rate limits by design; don't shed them as the app would
+    os.environ.setdefault("ADMISSION_MAX_WAIT_S", "3600")
+
+    from engine import SERVICES, VoiceEngine, run_sync
+    from router import DEFAULT_DEPLOYMENTS, build_pool, get_pool
+    from settings import ServiceConfig, get_number
+    from tts_cache import get_tts_cache
+
+    concurrency = _parse_limits(args.concurrency, "--concurrency")
+    rpm = _parse_limits(args.rpm, "--rpm")
+    tpm = _parse_limits(args.tpm, "--tpm")
+    registry = Metrics(window=100_000)
+    engine = VoiceEngine(
+        limits={svc: int(concurrency.get(svc) or get_number(f"ENGINE_MAX_CONCURRENT_{svc.upper()}", 32)) for svc in SERVICES},
+        rates={svc: rpm.get(svc, get_number(f"ENGINE_RPM_{svc.upper()}", 0)) for svc in SERVICES},
+        token_rates={svc: tpm.get(svc, get_number(f"ENGINE_TPM_{svc.upper()}", 0)) for svc in SERVICES},
+        registry=registry,
+    )
+    if server is not None:
+        # Straight at the mock, as bench_pipeline.py does: per-service endpoints, keys and pools in .env must not apply
+        mock = [(ServiceConfig(server.url, "2024-10-21", "mock-key"), None)]
+        pools = {svc: build_pool(svc, mock, DEFAULT_DEPLOYMENTS[svc]) for svc in SERVICES}
+    else:
+        pools = {svc: get_pool(svc) for svc in SERVICES}
+    checkpoint_path = args.out / "checkpoint.txt"
+    done_ids = set() if args.restart else read_checkpoint(checkpoint_path)
+    if args.restart and checkpoint_path.exists():
+        checkpoint_path.unlink()
+    if done_ids:
+        print(f"Resuming: {len(done_ids)} items already done")
+
+    outcome = run_sync(run_batch(engine, pools, iter_items(args.source), args.out, max(1, args.workers), args.voice,
+                                 done_ids, registry, write_audio=not args.no_audio,
+                                 tts_cache=None if server is not None else get_tts_cache(),
+                                 progress=None if args.quiet else print))
+    processed = outcome["ok"] + outcome["partial"] + outcome["failed"]
+    print("=" * 70)
+    print(f"{processed} processed ({outcome['ok']} ok, {outcome['partial']} partial, {outcome['failed']} failed), {outcome['skipped']} skipped "
+          f"in {outcome['seconds']:.1f} s → {processed / outcome['seconds'] if outcome['seconds'] else 0:.2f} items/s")
+    print("Limits: " + ", ".join(f"{svc} {engine.limits[svc]} in flight" + (f" / {engine.rates[svc]:g} rpm" if engine.rates[svc] else "")
+                                  for svc in SERVICES))
+    print("=" * 70)
+    print(f"{'stage':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for row in registry.summary():
+        print(f"{row['stage']:<18}{row['count']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['errors']:>8g}")
+    print(f"Results: {args.out / 'results.jsonl'}")
+    if server is not None:
+        server.shutdown()
+    return 1 if outcome["failed"] or outcome["partial"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of language detection: the old two-pass ``detect_hi_en``
+against the single-pass ``lang_detect.detect_language``.
+
+Runs both over short and long English, Hindi, Hinglish and Tamil texts and
+prints the time per call and per character, then what each one answers for
+every sample:
+
+    python bench_langdetect.py --repeat 2000
+"""
+import argparse
+import sys
+import timeit
+
+from lang_detect import detect_language
+
+SAMPLES = {
+    "english": "Sure, happy to help with that. The short answer is yes, and here is why it matters today.",
+    "hindi": "नमस्ते, आज मौसम कैसा है? मुझे कल दिल्ली जाना है, ट्रेन का समय बता दीजिए।",
+    "hinglish": "namaste, aaj ka mausam kaisa hai? mujhe kal Delhi jaana hai, train ka time bata do please",
+    "mixed": "Mera flight number AI 302 hai, कृपया status check kar do and send me an SMS.",
+    "tamil": "வணக்கம், இன்று வானிலை எப்படி இருக்கிறது? நாளை சென்னைக்கு போக வேண்டும்.",
+}
+
+
+def detect_hi_en_two_pass(text: str) -> str:
+    """The detector as it was: one pass for Devanagari, one for ``isalpha``."""
+    if not text:
+        return 'en'
+    devanagari = sum(1 for ch in text if 'ऀ' <= ch <= 'ॿ')
+    letters = sum(1 for ch in text if ch.isalpha())
+    if letters > 0 and (devanagari / letters) >= 0.3:
+        return 'hi'
+    return 'en'
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=2000, help="calls per detector and sample")
+    parser.add_argument("--long", type=int, default=20, help="the long variant repeats each sample this many times")
+    args = parser.parse_args(argv)
+
+    detectors = {"two-pass (old)": detect_hi_en_two_pass, "detect_language": detect_language}
+    texts = {**SAMPLES, **{f"{name} x{args.long}": " ".join([text] * args.long) for name, text in SAMPLES.items()}}
+
+    print(f"{'sample':<16}{'chars':>7}" + "".join(f"{name:>18}" for name in detectors) + "   (µs/call, ns/char)")
+    totals = dict.fromkeys(detectors, 0.0)
+    for label, text in texts.items():
+        cells = []
+        for name, fn in detectors.items():
+            seconds = min(timeit.repeat(lambda: fn(text), number=args.repeat, repeat=3)) / args.repeat
+            totals[name] += seconds
+            cells.append(f"{seconds * 1e6:>9.1f} {seconds * 1e9 / len(text):>5.0f}ns")
+        print(f"{label:<16}{len(text):>7}" + "".join(f"{cell:>18}" for cell in cells))
+    base = totals["two-pass (old)"]
+    print("Total vs old: " + ", ".join(f"{name} {base / total:.1f}x" for name, total in totals.items() if name != "two-pass (old)"))
+
+    print(f"\n{'sample':<16}{'old':>6}{'detect_language':>17}")
+    for label, text in SAMPLES.items():
+        print(f"{label:<16}{detect_hi_en_two_pass(text):>6}{detect_language(text):>17}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
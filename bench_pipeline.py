@@ -0,0 +1,188 @@
+"""
+Load-test the voice pipeline against the local mock (or any endpoint).
+
+Simulates N concurrent voice sessions, each running ``VoiceEngine.run_turn``
+(the same STT → chat → streamed TTS code the app uses) for a number of turns,
+then reports throughput, per-stage p50/p95 and error rates. Sessions are
+coroutines on the engine loop, as in the app. Runs fully offline by default,
+so it can gate CI:
+
+    python bench_pipeline.py --sessions 20 --turns 5 --max-p95 turn=4000
+
+Exits with status 1 when a --max-p95 or --max-error-rate threshold is missed.
+``--regions N`` starts N mock servers and routes every service across them,
+exercising the endpoint router's failover (combine with --error-429-rate).
+``--warmup`` pre-connects every endpoint first (as ``WARMUP_ENABLED=1`` does
+in the app); compare the ``first_turn`` row with and without it.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import struct
+import sys
+import time
+import wave
+
+from conversation import Conversation
+from metrics import Metrics, TurnTrace
+from mock_azure import add_config_args, config_from_args, start_mock_server
+
+
+def synthetic_clip(seconds: float = 3.0, rate: int = 48000) -> bytes:
+    """Stereo WAV with half a second of silence around a tone, like a mic capture."""
+    frames = bytearray()
+    total = int(seconds * rate)
+    for i in range(total):
+        voiced = 0.5 * rate <= i < total - 0.5 * rate
+        v = int(6000 * math.sin(2 * math.pi * 220 * i / rate)) if voiced else 0
+        frames += struct.pack("<hh", v, v)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+async def run_load(engine, pools: dict, clip: bytes, sessions: int, turns: int, registry: Metrics,
+                   reply_cache=None, history: bool = True) -> dict:
+    outcome = {"turns": 0, "failed_turns": 0, "tts_errors": 0, "errors": {}}
+
+    async def _session(index: int):
+        # Each session carries its own history, as in the app
+        conversation = Conversation.from_env() if history else None
+        for _ in range(turns):
+            trace = TurnTrace(registry, session_id=f"bench-{index}")
+            t0 = time.perf_counter()
+            try:
+                result = await engine.run_turn(pools, clip, trace=trace, reply_cache=reply_cache,
+                                               conversation=conversation)
+                failed, tts_errors, error = False, len(result.errors), None
+            except Exception as e:
+                failed, tts_errors, error = True, 0, type(e).__name__
+            registry.observe("turn", time.perf_counter() - t0)
+            if not outcome["turns"]:
+                registry.observe("first_turn", time.perf_counter() - t0)
+            outcome["turns"] += 1
+            outcome["failed_turns"] += failed
+            outcome["tts_errors"] += tts_errors
+            if error:
+                outcome["errors"][error] = outcome["errors"].get(error, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_session(i) for i in range(sessions)))
+    outcome["seconds"] = time.perf_counter() - started
+    return outcome
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent voice sessions")
+    parser.add_argument("--turns", type=int, default=3, help="turns per session")
+    parser.add_argument("--clip-seconds", type=float, default=3.0)
+    parser.add_argument("--endpoint", action="append", default=[],
+                        help="target this endpoint instead of starting the mock (repeatable: one pool entry each)")
+    parser.add_argument("--regions", type=int, default=1, help="number of mock servers to route across")
+    parser.add_argument("--hedge-ms", type=float, default=0, help="hedge requests slower than this (0 = off)")
+    parser.add_argument("--no-history", action="store_true", help="send each turn without conversation history")
+    parser.add_argument("--reply-cache", action="store_true",
+                        help="enable the LLM reply cache (the mock's transcript never changes, so turns after the first hit)")
+    parser.add_argument("--warmup", action="store_true", help="warm every endpoint before the first turn")
+    parser.add_argument("--api-key", default="mock-key")
+    parser.add_argument("--api-version", default="2024-10-21")
+    parser.add_argument("--max-retries", type=int, default=2)
+    parser.add_argument("--max-p95", action="append", default=[], metavar="STAGE=MS",
+                        help="fail if a stage's p95 exceeds MS (repeatable; 'turn' is end-to-end)")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="fail if failed turns / turns exceeds this")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    add_config_args(parser)
+    args = parser.parse_args(argv)
+
+    servers = []
+    endpoints = args.endpoint
+    if not endpoints:
+        servers = [start_mock_server(config_from_args(args)) for _ in range(max(1, args.regions))]
+        endpoints = [server.url for server in servers]
+    os.environ["AZURE_OPENAI_MAX_RETRIES"] = str(args.max_retries)
+    # Pool size must cover every concurrent stream or sessions queue on connections
+    os.environ.setdefault("AZURE_OPENAI_MAX_CONNECTIONS", str(max(100, args.sessions * 4)))
+
+    from engine import VoiceEngine, run_sync
+    from reply_cache import ReplyCache
+    from router import DEFAULT_DEPLOYMENTS, build_pool
+    from settings import ServiceConfig
+
+    members = [(ServiceConfig(url, args.api_version, args.api_key), None) for url in endpoints]
+    pools = {svc: build_pool(svc, members, dep, hedge_after_s=args.hedge_ms / 1000)
+             for svc, dep in DEFAULT_DEPLOYMENTS.items()}
+    registry = Metrics(window=100_000)
+
+    reply_cache = ReplyCache(ttl_s=3600, max_entries=1024, registry=registry) if args.reply_cache else None
+    if args.warmup:
+        from warmup import Warmup
+
+        run_sync(Warmup(pools, refresh_s=0, registry=registry).warm_once())
+
+    outcome = run_sync(run_load(VoiceEngine(registry=registry), pools, synthetic_clip(args.clip_seconds),
+                                args.sessions, args.turns, registry, reply_cache, not args.no_history))
+    rows = registry.summary()
+    report = {
+        "sessions": args.sessions,
+        "turns": outcome["turns"],
+        "seconds": round(outcome["seconds"], 3),
+        "turns_per_s": round(outcome["turns"] / outcome["seconds"], 3) if outcome["seconds"] else 0.0,
+        "error_rate": round(outcome["failed_turns"] / outcome["turns"], 4) if outcome["turns"] else 0.0,
+        "tts_segment_errors": outcome["tts_errors"],
+        "errors": outcome["errors"],
+        "stages": rows,
+        "reply_cache": reply_cache.snapshot() if reply_cache else {},
+        "servers": [dict(server.stats) for server in servers],
+        "endpoints": {svc: pool.stats() for svc, pool in pools.items()} if len(endpoints) > 1 else {},
+    }
+
+    failures = []
+    by_stage = {row["stage"]: row for row in rows}
+    for spec in args.max_p95:
+        stage, _, limit = spec.partition("=")
+        row = by_stage.get(stage)
+        if row is None:
+            failures.append(f"no samples for stage {stage!r}")
+        elif row["p95_ms"] > float(limit):
+            failures.append(f"{stage} p95 {row['p95_ms']} ms > {limit} ms")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {report['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    report["failures"] = failures
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print("=" * 70)
+        print(f"{report['sessions']} sessions, {report['turns']} turns in {report['seconds']} s "
+              f"→ {report['turns_per_s']} turns/s, error rate {report['error_rate']:.2%}")
+        print("=" * 70)
+        print(f"{'stage':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for row in rows:
+            print(f"{row['stage']:<18}{row['count']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{row['errors']:>8g}")
+        if report["errors"]:
+            print("Turn errors:", report["errors"])
+        if report["reply_cache"]:
+            print("Reply cache:", report["reply_cache"])
+        for i, stats in enumerate(report["servers"]):
+            print(f"Mock server {i}:", stats)
+        for svc, rows in report["endpoints"].items():
+            for row in rows:
+                print(f"{svc:<5} {row['endpoint']:<28} requests {row['requests']:>5}  errors {row['errors']:>4}"
+                      f"  ewma {row['ewma_ms']:>5} ms  hedges {row['hedges']}")
+        for failure in failures:
+            print("❌", failure)
+    for server in servers:
+        server.shutdown()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
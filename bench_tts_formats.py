@@ -0,0 +1,117 @@
+"""
+Compare TTS output formats: bytes per second of speech and playback start.
+
+Synthesizes the same sentences in every format (through
+``VoiceEngine.synthesize``, the app's code path, with no TTS cache) against
+the local mock or a real endpoint, and reports per format:
+
+- bytes and kbps per second of speech (the speech duration comes from the
+  PCM clip, which is 24 kHz 16-bit mono, so its size gives the exact length);
+- median synthesis time of the first sentence;
+- estimated time until the browser can start playing the first sentence on
+  each link class: synthesis + download of the clip + one round trip.
+
+The mock sizes clips by ``audio_format.FORMATS[...].nominal_kbps``, so only a
+real endpoint measures the codecs themselves:
+
+    python bench_tts_formats.py --endpoint https://<resource>.openai.azure.com/ --api-key $KEY --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from audio_format import FORMATS, PCM_RATE
+from mock_azure import add_config_args, config_from_args, start_mock_server
+
+SENTENCES = [
+    "Sure, happy to help with that.",
+    "The short answer is yes, and here is why it matters for your trip tomorrow.",
+    "Trains to Delhi leave every hour from platform four, and the last one is at ten.",
+]
+# Link class → (downlink Mbps, round trip ms), roughly the Network Information API's ECT buckets
+LINKS = {"2g": (0.25, 1400), "3g": (0.7, 270), "4g": (4.0, 100), "wifi": (20.0, 30)}
+_WAV_HEADER = 44  # ``AudioFormat.playable`` wraps PCM in a plain RIFF/WAVE header
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=3, help="synthesis runs per format")
+    parser.add_argument("--format", action="append", default=[], choices=list(FORMATS),
+                        help="only these formats (repeatable; pcm is always run to measure speech length)")
+    parser.add_argument("--voice", default="nova")
+    parser.add_argument("--endpoint", default=None, help="target this endpoint instead of starting the mock")
+    parser.add_argument("--api-key", default="mock-key")
+    parser.add_argument("--api-version", default="2024-10-21")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    add_config_args(parser)
+    args = parser.parse_args(argv)
+
+    server = None
+    endpoint = args.endpoint
+    if not endpoint:
+        server = start_mock_server(config_from_args(args))
+        endpoint = server.url
+    os.environ.setdefault("AZURE_OPENAI_MAX_RETRIES", "2")
+
+    from engine import VoiceEngine, run_sync
+    from metrics import Metrics
+    from router import DEFAULT_DEPLOYMENTS, build_pool
+    from settings import ServiceConfig
+
+    pool = build_pool("tts", [(ServiceConfig(endpoint, args.api_version, args.api_key), None)], DEFAULT_DEPLOYMENTS["tts"])
+    engine = VoiceEngine(registry=Metrics())
+    formats = ["pcm", *(name for name in (args.format or FORMATS) if name != "pcm")]
+
+    sizes: dict[str, list[int]] = {}
+    first_s: dict[str, list[float]] = {}
+    for name in formats:
+        first_s[name] = []
+        for _ in range(args.repeat):
+            clips = []
+            for text in SENTENCES:
+                t0 = time.perf_counter()
+                clips.append(run_sync(engine.synthesize(pool, args.voice, text, fmt=name)))
+                if len(clips) == 1:
+                    first_s[name].append(time.perf_counter() - t0)
+            sizes[name] = [len(clip) for clip in clips]
+
+    # Seconds of speech per sentence, from the PCM clips
+    durations = [(size - _WAV_HEADER) / (PCM_RATE * 2) for size in sizes["pcm"]]
+    speech_s = sum(durations)
+    report = {"speech_s": round(speech_s, 2), "sentences": len(SENTENCES), "repeat": args.repeat, "formats": {}}
+    for name in formats:
+        synth_s = statistics.median(first_s[name])
+        first_bytes = sizes[name][0]
+        report["formats"][name] = {
+            "mimetype": FORMATS[name].mimetype,
+            "bytes": sum(sizes[name]),
+            "bytes_per_speech_s": round(sum(sizes[name]) / speech_s) if speech_s else 0,
+            "kbps": round(sum(sizes[name]) * 8 / 1000 / speech_s, 1) if speech_s else 0.0,
+            "first_synth_ms": round(synth_s * 1000),
+            "first_clip_bytes": first_bytes,
+            "playback_start_ms": {
+                link: round((synth_s + first_bytes * 8 / (mbps * 1e6) + rtt_ms / 1000) * 1000)
+                for link, (mbps, rtt_ms) in LINKS.items()
+            },
+        }
+    if server is not None:
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"{report['sentences']} sentences, {report['speech_s']} s of speech, median of {args.repeat} runs")
+    print(f"{'format':<8}{'bytes':>10}{'B/s speech':>12}{'kbps':>8}{'synth ms':>10}"
+          + "".join(f"{'start ' + link:>12}" for link in LINKS))
+    for name, row in report["formats"].items():
+        print(f"{name:<8}{row['bytes']:>10}{row['bytes_per_speech_s']:>12}{row['kbps']:>8}{row['first_synth_ms']:>10}"
+              + "".join(f"{row['playback_start_ms'][link]:>12}" for link in LINKS))
+    print("start = first sentence's synthesis + its download on the link + one round trip (ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Process-wide registry of pooled Azure OpenAI clients.
+
+Streamlit re-executes ``app.py`` on every rerun and for every session, but
+imported modules live for the whole server process. Clients are cached here
+per (endpoint, API version, key) so keep-alive connections and TLS sessions
+are reused across reruns and sessions, and services that resolve to the same
+resource share a single connection pool.
+"""
+import hashlib
+import threading
+
+from openai import DEFAULT_CONNECTION_LIMITS, AsyncAzureOpenAI, DefaultAsyncHttpxClient, Timeout
+
+from settings import ServiceConfig, get_number
+
+# The Limits class of the httpx build openai uses (not necessarily `import httpx`)
+Limits = type(DEFAULT_CONNECTION_LIMITS)
+
+_lock = threading.Lock()
+_async_clients: dict[tuple[str, str, str], AsyncAzureOpenAI] = {}
+
+
+def pool_limits() -> Limits:
+    """Connection pool bounds shared by every cached client."""
+    return Limits(
+        max_connections=int(get_number("AZURE_OPENAI_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(get_number("AZURE_OPENAI_MAX_KEEPALIVE", 20)),
+        keepalive_expiry=get_number("AZURE_OPENAI_KEEPALIVE_EXPIRY", 90),
+    )
+
+
+def request_timeout() -> Timeout:
+    return Timeout(
+        get_number("AZURE_OPENAI_TIMEOUT", 60),
+        connect=get_number("AZURE_OPENAI_CONNECT_TIMEOUT", 5),
+    )
+
+
+def _registry_key(cfg: ServiceConfig) -> tuple[str, str, str]:
+    # Endpoints differing only by a trailing slash or case are the same resource;
+    # hash the key so the registry never holds it in plain text
+    endpoint = (cfg.endpoint or "").strip().rstrip("/").lower()
+    key_digest = hashlib.sha256((cfg.api_key or "").encode("utf-8")).hexdigest()
+    return endpoint, cfg.api_version or "", key_digest
+
+
+def async_client_for(cfg: ServiceConfig) -> AsyncAzureOpenAI:
+    """Return the shared async client for a resolved service configuration.
+
+    Async clients are bound to the event loop that first uses them; the voice
+    engine runs every request on its single loop, so one per resource is enough.
+    """
+    key = _registry_key(cfg)
+    client = _async_clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _async_clients.get(key)
+        if client is None:
+            client = AsyncAzureOpenAI(
+                api_key=cfg.api_key,
+                api_version=cfg.api_version,
+                azure_endpoint=cfg.endpoint,
+                http_client=DefaultAsyncHttpxClient(limits=pool_limits(), timeout=request_timeout()),
+                max_retries=int(get_number("AZURE_OPENAI_MAX_RETRIES", 2)),
+            )
+            _async_clients[key] = client
+        return client
+
+
+def client_count() -> int:
+    """Number of distinct connection pools currently open in this process."""
+    return len(_async_clients)
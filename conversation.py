@@ -0,0 +1,209 @@
+"""
+Per-session conversation history with a bounded prompt size.
+
+Recent turns are sent verbatim; once they outgrow the token budget, the
+oldest ones are folded into a rolling summary by a background chat call, so
+prompt tokens stay flat however long a session runs. Token counts are
+estimated locally (no tokenizer download, no network call). The system
+prompt always comes first and is never rewritten, and the summary changes
+only when a batch of turns is folded, so the prompt prefix stays stable for
+provider-side prompt caching.
+"""
+import threading
+from dataclasses import dataclass
+
+from settings import get_number
+
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_INSTRUCTIONS = (
+    "You keep a running summary of a voice conversation between a user and an assistant. "
+    "Merge the existing summary with the new exchanges into one short paragraph in English. "
+    "Keep names, preferences, facts the user shared and open questions; drop greetings and filler. "
+    "Use at most {words} words."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough BPE token count: ~4 ASCII characters per token, ~1 token per other character.
+
+    Devanagari and other non-Latin scripts tokenize far less efficiently than
+    English, so they are counted per character to stay on the safe side.
+    """
+    ascii_chars = sum(1 for ch in text if ch < "\x80")
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def estimate_messages_tokens(messages: list[dict]) -> int:
+    return sum(estimate_tokens(str(m.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the end of ``text`` (the most recent content) within ``max_tokens``."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if estimate_tokens(text[mid:]) <= max_tokens:
+            hi = mid
+        else:
+            lo = mid + 1
+    cut = text.find(" ", lo)
+    return "…" + text[cut + 1 if 0 <= cut < lo + 40 else lo:]
+
+
+@dataclass
+class Turn:
+    key: str
+    user: str
+    assistant: str
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.user) + estimate_tokens(self.assistant) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+@dataclass
+class FoldJob:
+    """Turns being folded into the summary by a background call."""
+    generation: int
+    previous_summary: str
+    turns: tuple[Turn, ...]
+    messages: list[dict]
+
+
+class Conversation:
+    """Recent turns plus a rolling summary of older ones, within a token budget.
+
+    ``budget_tokens`` bounds everything between the system prompt and the new
+    user message (summary + verbatim turns). Turns are keyed by the recording
+    they answer, so a Streamlit rerun that re-asks the same clip replaces its
+    turn instead of appending a duplicate.
+    """
+
+    def __init__(self, budget_tokens: int = 1500, summary_tokens: int = 250):
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        self._turns: list[Turn] = []
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._folding = False
+        self.folds = 0
+        self.fallback_folds = 0
+        self.last_prompt_tokens = 0
+
+    @classmethod
+    def from_env(cls) -> "Conversation":
+        return cls(
+            budget_tokens=int(get_number("HISTORY_TOKEN_BUDGET", 1500)),
+            summary_tokens=int(get_number("HISTORY_SUMMARY_TOKENS", 250)),
+        )
+
+    @property
+    def recent_budget(self) -> int:
+        return max(self.budget_tokens - self.summary_tokens, 0)
+
+    def messages(self, system_prompt: str, user_text: str, turn_key: str | None = None) -> list[dict]:
+        """Chat messages for a new user message, history included.
+
+        A turn already recorded under ``turn_key`` (the current clip, on a
+        rerun) is left out so the model sees the same history as the first time.
+        """
+        with self._lock:
+            summary = self.summary
+            turns = [t for t in self._turns if t.key != turn_key]
+        # While a fold is still running, drop the oldest turns from this prompt
+        # (not from the history) so the budget holds regardless
+        budget = self.budget_tokens - (estimate_tokens(summary) + MESSAGE_OVERHEAD_TOKENS if summary else 0)
+        kept: list[Turn] = []
+        for turn in reversed(turns):
+            if turn.tokens > budget:
+                break
+            kept.append(turn)
+            budget -= turn.tokens
+        messages = [{"role": "system", "content": system_prompt}]
+        if summary:
+            messages.append({"role": "system", "content": "Summary of the earlier conversation: " + summary})
+        for turn in reversed(kept):
+            messages.append({"role": "user", "content": turn.user})
+            messages.append({"role": "assistant", "content": turn.assistant})
+        messages.append({"role": "user", "content": user_text})
+        self.last_prompt_tokens = estimate_messages_tokens(messages)
+        return messages
+
+    def record(self, turn_key: str, user_text: str, reply_text: str) -> None:
+        with self._lock:
+            if self._turns and self._turns[-1].key == turn_key:
+                self._turns[-1] = Turn(turn_key, user_text, reply_text)
+            else:
+                self._turns.append(Turn(turn_key, user_text, reply_text))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._turns.clear()
+            self.summary = ""
+            self._generation += 1
+            self._folding = False
+
+    # --- Rolling summary ---
+    def start_fold(self) -> FoldJob | None:
+        """Claim the oldest turns for summarizing once verbatim turns exceed the budget.
+
+        Folds down to half the budget at once, so the summary (and with it the
+        prompt prefix) changes every few turns rather than every turn. The most
+        recent turn is never folded. Returns None when nothing needs folding.
+        """
+        with self._lock:
+            if self._folding or sum(t.tokens for t in self._turns) <= self.recent_budget:
+                return None
+            remaining = sum(t.tokens for t in self._turns)
+            count = 0
+            while count < len(self._turns) - 1 and remaining > self.recent_budget // 2:
+                remaining -= self._turns[count].tokens
+                count += 1
+            if not count:
+                return None
+            self._folding = True
+            turns = tuple(self._turns[:count])
+            previous = self.summary
+            generation = self._generation
+        transcript = "\n".join(f"User: {t.user}\nAssistant: {t.assistant}" for t in turns)
+        words = max(self.summary_tokens * 3 // 4, 20)
+        return FoldJob(generation, previous, turns, [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(words=words)},
+            {"role": "user", "content": f"Summary so far:\n{previous or '(none)'}\n\nNew exchanges:\n{transcript}"},
+        ])
+
+    def finish_fold(self, job: FoldJob, summary: str | None) -> None:
+        """Apply a fold; ``summary=None`` (the call failed) falls back to a local digest."""
+        if not summary or not summary.strip():
+            digest = " ".join(f"User: {t.user} Assistant: {t.assistant}" for t in job.turns)
+            summary = (job.previous_summary + " " + digest).strip()
+            fallback = True
+        else:
+            fallback = False
+        summary = truncate_to_tokens(summary.strip(), self.summary_tokens)
+        with self._lock:
+            if job.generation != self._generation:
+                return
+            self._folding = False
+            folded = {id(t) for t in job.turns}
+            self._turns = [t for t in self._turns if id(t) not in folded]
+            self.summary = summary
+            self.folds += 1
+            self.fallback_folds += fallback
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "turns": len(self._turns),
+                "turn_tokens": sum(t.tokens for t in self._turns),
+                "summary_tokens": estimate_tokens(self.summary),
+                "folds": self.folds,
+                "fallback_folds": self.fallback_folds,
+                "folding": self._folding,
+                "last_prompt_tokens": self.last_prompt_tokens,
+            }
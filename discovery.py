@@ -0,0 +1,206 @@
+"""
+Find working (deployment, API version) combinations for chat, Whisper and TTS.
+
+Every candidate combination is probed concurrently with a short timeout. The
+winner is the working combination that ranks first in ``candidates`` order,
+so the configured deployment and API version win whenever they work and a
+guess is only used when they fail; once a combination works, the probes
+ranked below it are cancelled. The winners are saved to a local cache with a
+TTL, and ``router.py`` reads the cache at startup so the app uses the
+validated deployment map without probing again. Run it directly to (re)discover:
+
+    python discovery.py                # all services, prints suggested .env lines
+    python discovery.py --service tts --timeout 5
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from audio_prep import pcm_to_wav
+from clients import async_client_for
+from settings import CHAT_PREFIX, STT_PREFIX, TTS_PREFIX, ServiceConfig, get_env_or_secret, get_number, resolve_service
+
+SERVICE_PREFIXES = {"chat": CHAT_PREFIX, "stt": STT_PREFIX, "tts": TTS_PREFIX}
+CANDIDATE_DEPLOYMENTS = {
+    "chat": ["gpt-4.1", "gpt-4o", "gpt-4o-mini", "gpt-4", "gpt-35-turbo"],
+    "stt": ["whisper", "whisper-1"],
+    "tts": ["tts", "tts-001", "tts-hd", "tts-hd-001"],
+}
+CANDIDATE_VERSIONS = ["2025-03-01-preview", "2024-10-21", "2024-08-01-preview", "2024-06-01",
+                      "2024-02-15-preview", "2023-12-01-preview"]
+DEFAULT_CACHE_PATH = Path(__file__).parent / ".cache" / "discovery.json"
+
+
+@dataclass
+class Discovered:
+    deployment: str
+    api_version: str
+    latency_ms: float
+
+
+def cache_path() -> Path:
+    return Path(get_env_or_secret("DISCOVERY_CACHE_PATH", str(DEFAULT_CACHE_PATH)))
+
+
+def _fingerprint(service: str) -> str:
+    """Identifies the configuration a discovery result was validated against."""
+    prefix = SERVICE_PREFIXES[service]
+    cfg = resolve_service(prefix)
+    raw = "\x00".join([
+        (cfg.endpoint or "").strip().rstrip("/").lower(),
+        cfg.api_version or "",
+        get_env_or_secret(f"{prefix}_DEPLOYMENT") or "",
+        hashlib.sha256((cfg.api_key or "").encode("utf-8")).hexdigest(),
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def candidates(service: str) -> list[tuple[str, str]]:
+    """(deployment, api_version) pairs, configured values first."""
+    prefix = SERVICE_PREFIXES[service]
+    configured_dep = get_env_or_secret(f"{prefix}_DEPLOYMENT")
+    configured_ver = resolve_service(prefix).api_version
+    deployments = list(dict.fromkeys([d for d in [configured_dep, *CANDIDATE_DEPLOYMENTS[service]] if d]))
+    versions = list(dict.fromkeys([v for v in [configured_ver, *CANDIDATE_VERSIONS] if v]))
+    # Breadth-first over deployments so the configured version of each name is tried early
+    return [(dep, ver) for ver in versions for dep in deployments]
+
+
+async def probe(service: str, client, deployment: str) -> None:
+    """The smallest real request for ``service``: 1 chat token, half a second of audio, one TTS word."""
+    if service == "chat":
+        await client.chat.completions.create(model=deployment, max_tokens=1,
+                                             messages=[{"role": "user", "content": "Hi"}])
+    elif service == "tts":
+        response = await client.audio.speech.create(model=deployment, voice="nova", input="Hi")
+        await response.aread()
+    else:
+        # Half a second of silence is enough to prove the deployment accepts audio
+        await client.audio.transcriptions.create(model=deployment, file=("probe.wav", pcm_to_wav(b"\x00" * 16000)))
+
+
+async def discover_service(service: str, timeout_s: float = 8.0, concurrency: int = 8,
+                           log=None) -> Discovered | None:
+    """Probe all candidates for one service; the best-ranked success wins and cancels the rest."""
+    base = resolve_service(SERVICE_PREFIXES[service])
+    limit = asyncio.Semaphore(concurrency)
+
+    async def _attempt(deployment: str, version: str) -> Discovered:
+        async with limit:
+            cfg = ServiceConfig(base.endpoint, version, base.api_key)
+            client = async_client_for(cfg).with_options(max_retries=0)
+            t0 = time.perf_counter()
+            try:
+                await asyncio.wait_for(probe(service, client, deployment), timeout_s)
+            except Exception as e:
+                if log:
+                    log(f"  {service}: {deployment} @ {version} → {type(e).__name__}: {str(e)[:120]}")
+                raise
+            return Discovered(deployment, version, round((time.perf_counter() - t0) * 1000, 1))
+
+    tasks = [asyncio.ensure_future(_attempt(dep, ver)) for dep, ver in candidates(service)]
+    for task in tasks:
+        # Losing probes may still fail after the winner is in; that's expected
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    try:
+        # In rank order, not completion order: a faster guess must not beat the configured pair
+        for task in tasks:
+            try:
+                return await task
+            except Exception:
+                continue
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def discover(services=("chat", "stt", "tts"), timeout_s: float = 8.0, concurrency: int = 8,
+                   log=None) -> dict[str, Discovered | None]:
+    """Discover all services concurrently."""
+    results = await asyncio.gather(*(discover_service(svc, timeout_s, concurrency, log) for svc in services))
+    return dict(zip(services, results))
+
+
+# --- Cache ---
+def save_cache(found: dict[str, Discovered | None], path: Path | None = None) -> None:
+    path = path or cache_path()
+    data = _read(path)
+    now = time.time()
+    for service, result in found.items():
+        if result is not None:
+            data[service] = {**asdict(result), "fingerprint": _fingerprint(service), "validated": now}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Atomic replace so the app never reads a half-written map
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _read(path: Path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def cached_service(service: str, path: Path | None = None) -> Discovered | None:
+    """The cached winner for ``service`` if it is fresh and matches the current settings."""
+    entry = _read(path or cache_path()).get(service)
+    if not isinstance(entry, dict):
+        return None
+    max_age = get_number("DISCOVERY_TTL_H", 24) * 3600
+    if time.time() - float(entry.get("validated", 0)) > max_age or entry.get("fingerprint") != _fingerprint(service):
+        return None
+    try:
+        return Discovered(entry["deployment"], entry["api_version"], float(entry.get("latency_ms", 0)))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def main(argv: list[str] | None = None) -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--service", action="append", choices=list(SERVICE_PREFIXES), help="repeatable; default all")
+    parser.add_argument("--timeout", type=float, default=get_number("DISCOVERY_PROBE_TIMEOUT_S", 8), help="seconds per probe")
+    parser.add_argument("--concurrency", type=int, default=8, help="probes in flight per service")
+    parser.add_argument("--no-save", action="store_true", help="don't write the discovery cache")
+    parser.add_argument("--quiet", action="store_true", help="don't print failed probes")
+    args = parser.parse_args(argv)
+    services = tuple(args.service or SERVICE_PREFIXES)
+
+    from engine import run_sync
+
+    for svc in services:
+        print(f"{svc}: endpoint {resolve_service(SERVICE_PREFIXES[svc]).endpoint}, {len(candidates(svc))} candidates")
+    t0 = time.perf_counter()
+    found = run_sync(discover(services, args.timeout, args.concurrency, log=None if args.quiet else print))
+    print(f"\nDone in {time.perf_counter() - t0:.1f} s")
+    for svc, result in found.items():
+        prefix = SERVICE_PREFIXES[svc]
+        if result is None:
+            print(f"❌ {svc}: no working combination")
+        else:
+            print(f"✅ {svc}: {result.deployment} @ {result.api_version} ({result.latency_ms:.0f} ms)")
+            print(f"   {prefix}_DEPLOYMENT={result.deployment}")
+            print(f"   {prefix}_API_VERSION={result.api_version}")
+    if not args.no_save:
+        save_cache(found)
+        print(f"\nSaved to {cache_path()}")
+    return 0 if all(found.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
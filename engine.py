@@ -0,0 +1,611 @@
+"""
+Asyncio voice engine: the network stages of the pipeline (Whisper, chat,
+TTS) as coroutines on ``AsyncAzureOpenAI`` clients.
+
+All sessions share one event loop running on a background thread, so a
+session waiting on Azure costs a suspended coroutine rather than a blocked
+server thread. Independent work overlaps (TTS for sentence N runs while
+sentence N+1 is still streaming). Each service has a process-wide
+scheduler (``admission.py``) that admits requests fairly across sessions
+within its concurrency cap and RPM/TPM quota. Requests go through an ``EndpointPool`` per service, which
+picks the healthiest endpoint and fails over between them. ``run_sync`` and
+``iter_sync`` bridge the loop into the synchronous Streamlit script. Work they
+start for a ``Turn`` is cancelled as soon as the same session starts its next
+turn (barge-in), so a superseded reply stops holding connections and quota.
+"""
+import asyncio
+import concurrent.futures
+import json
+import queue
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager, nullcontext
+
+from audio_format import FORMATS
+from audio_prep import PreparedAudio, segment_for_stt
+from conversation import Conversation, estimate_messages_tokens
+from admission import ServiceScheduler, retry_delay
+from metrics import Metrics, StageRecord, TurnTrace, metrics
+from lang_detect import detect_language
+from pipeline import ReplySegment, SentenceChunker, TurnResult, build_system_hint
+from reply_cache import ReplyCache
+from router import EndpointPool
+from settings import get_number
+from tts_cache import TTSCache, cache_key
+
+SERVICES = ("stt", "chat", "tts")
+# Completion tokens assumed per chat request when charging the TPM budget up front
+EXPECTED_REPLY_TOKENS = 300
+
+
+def _stage(trace: TurnTrace | None, name: str, **labels):
+    return trace.stage(name, **labels) if trace is not None else nullcontext(StageRecord(name))
+
+
+def _session(trace: TurnTrace | None) -> str:
+    return trace.session_id if trace is not None else ""
+
+
+class TurnCancelled(Exception):
+    """The turn was superseded by a newer turn of the same session."""
+
+    def __init__(self, turn: "Turn"):
+        super().__init__(f"turn {turn.turn_id} was superseded")
+        self.turn = turn
+
+
+class Turn:
+    """One pipeline run of a session: the engine work started for it, so it can be cancelled."""
+
+    def __init__(self, session: str, turn_id: str, recording: str = "", registry: Metrics = metrics):
+        self.session = session
+        self.turn_id = turn_id
+        self.recording = recording
+        self.registry = registry
+        self.cancelled = False
+        self._futures: set[concurrent.futures.Future] = set()
+        self._lock = threading.Lock()
+
+    def track(self, future: concurrent.futures.Future) -> None:
+        """Cancel ``future`` along with the turn (right away if it already was)."""
+        with self._lock:
+            if not self.cancelled:
+                self._futures.add(future)
+        if self.cancelled:
+            future.cancel()
+            raise TurnCancelled(self)
+        future.add_done_callback(self._futures.discard)
+
+    def cancel(self) -> int:
+        """Cancel everything still in flight; returns how many calls that stopped."""
+        with self._lock:
+            self.cancelled = True
+            futures, self._futures = list(self._futures), set()
+        return sum(future.cancel() for future in futures)
+
+
+class VoiceEngine:
+    """Pipeline stages as coroutines behind per-service admission control."""
+
+    def __init__(self, limits: dict[str, int] | None = None, rates: dict[str, float] | None = None,
+                 token_rates: dict[str, float] | None = None, registry: Metrics = metrics):
+        limits = limits or {
+            svc: int(get_number(f"ENGINE_MAX_CONCURRENT_{svc.upper()}", 32)) for svc in SERVICES
+        }
+        # Requests and tokens per minute; 0 means no limit
+        rates = rates or {svc: get_number(f"ENGINE_RPM_{svc.upper()}", 0) for svc in SERVICES}
+        token_rates = token_rates or {svc: get_number(f"ENGINE_TPM_{svc.upper()}", 0) for svc in SERVICES}
+        self.limits = limits
+        self.rates = {svc: rates.get(svc, 0) for svc in SERVICES}
+        self.registry = registry
+        self.retries = int(get_number("AZURE_OPENAI_MAX_RETRIES", 2))
+        self.schedulers = {
+            svc: ServiceScheduler(
+                svc, limits[svc], rpm=self.rates[svc], tpm=token_rates.get(svc, 0),
+                max_queue=int(get_number("ADMISSION_MAX_QUEUE", 256)),
+                max_wait_s=get_number("ADMISSION_MAX_WAIT_S", 30),
+                registry=registry,
+            )
+            for svc in SERVICES
+        }
+        self._background: set[asyncio.Task] = set()
+        self._turns: dict[str, Turn] = {}
+        self._turns_lock = threading.Lock()
+
+    @asynccontextmanager
+    async def slot(self, service: str, session: str = "", tokens: float = 1.0):
+        """Hold an admitted slot of the service for an ``async with`` block.
+
+        Raises ``admission.Overloaded`` when the service's queue is full or the
+        request waited too long.
+        """
+        scheduler = self.schedulers[service]
+        await scheduler.acquire(session, tokens)
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            scheduler.release(time.monotonic() - t0)
+
+    async def _call(self, service: str, pool: EndpointPool, fn):
+        """``pool.call(fn)`` with jittered retries that honour ``Retry-After``."""
+        attempt = 0
+        while True:
+            try:
+                return await pool.call(fn)
+            except Exception as e:
+                delay = retry_delay(e, attempt) if attempt < self.retries else None
+                if delay is None:
+                    raise
+                if getattr(e, "status_code", None) == 429:
+                    self.schedulers[service].throttled()
+                self.registry.incr("retries_total", service, type(e).__name__)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def _cancelled(self, service: str, unit: str = "", saved: float = 0) -> None:
+        self.registry.incr("cancelled_total", service)
+        if saved > 0:
+            self.registry.incr("cancel_saved_total", service, unit, amount=saved)
+
+    def begin_turn(self, session: str, turn_id: str, recording: str = "") -> Turn:
+        """Start the session's next turn and cancel whatever its previous turn still has in flight.
+
+        A different ``recording`` means the user spoke again (barge-in); the
+        same one is a rerun of the script (e.g. a sidebar change).
+        """
+        turn = Turn(session, turn_id, recording, self.registry)
+        with self._turns_lock:
+            previous = self._turns.get(session)
+            self._turns[session] = turn
+        if previous is not None and previous.cancel():
+            self.registry.incr("turns_cancelled_total", "barge_in" if previous.recording != recording else "rerun")
+        return turn
+
+    def end_turn(self, turn: Turn) -> None:
+        with self._turns_lock:
+            if self._turns.get(turn.session) is turn:
+                del self._turns[turn.session]
+
+    def position(self, session: str) -> tuple[str, int, float] | None:
+        """(service, place in queue, estimated wait) for the session's longest wait, if it is queued."""
+        waits = [(svc, *pos) for svc, scheduler in self.schedulers.items()
+                 if (pos := scheduler.position(session)) is not None]
+        return max(waits, key=lambda w: w[2]) if waits else None
+
+    def spawn(self, coro) -> asyncio.Task:
+        """Run ``coro`` in the background on the engine loop (call from the loop)."""
+        task = asyncio.ensure_future(coro)
+        # The loop only keeps weak references to tasks
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def load(self) -> dict[str, dict]:
+        """Active and queued requests and admission counts per service (for Diagnostics)."""
+        return {svc: scheduler.load() for svc, scheduler in self.schedulers.items()}
+
+    # --- Stages ---
+    async def transcribe(self, stt_pool: EndpointPool, prepared: PreparedAudio,
+                         trace: TurnTrace | None = None) -> str:
+        async with self.slot("stt", _session(trace)):
+            with _stage(trace, "stt") as rec:
+                rec.bytes_in = len(prepared.data)
+                result = await self._call("stt", stt_pool, lambda client, deployment: client.audio.transcriptions.create(
+                    file=(prepared.filename, prepared.data),
+                    model=deployment
+                ))
+                rec.bytes_out = len(result.text.encode("utf-8"))
+                return result.text
+
+    async def transcribe_segments(self, stt_pool: EndpointPool, segments,
+                                  trace: TurnTrace | None = None, workers: int | None = None) -> str:
+        """Transcribe speech segments concurrently and stitch the text back in order.
+
+        ``segments`` is a list of ``PreparedAudio`` or an async iterator of them
+        (e.g. fed by a live ``vad.SpeechSegmenter``), in which case each segment
+        is sent as soon as it closes. At most ``workers`` run at once.
+        """
+        limit = asyncio.Semaphore(workers or int(get_number("STT_SEGMENT_WORKERS", 4)))
+
+        async def _one(prepared: PreparedAudio) -> str:
+            async with limit:
+                return await self.transcribe(stt_pool, prepared, trace)
+
+        tasks: list[asyncio.Task] = []
+        with _stage(trace, "stt_segmented") as rec:
+            try:
+                if hasattr(segments, "__aiter__"):
+                    async for prepared in segments:
+                        tasks.append(asyncio.ensure_future(_one(prepared)))
+                else:
+                    tasks = [asyncio.ensure_future(_one(prepared)) for prepared in segments]
+                texts = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+            rec.labels["segments"] = len(tasks)
+            text = " ".join(t.strip() for t in texts if t and t.strip())
+            rec.bytes_out = len(text.encode("utf-8"))
+            return text
+
+    async def complete_chat(self, chat_pool: EndpointPool, messages: list[dict],
+                            trace: TurnTrace | None = None) -> str:
+        """Blocking (non-streamed) chat completion."""
+        try:
+            async with self.slot("chat", _session(trace), estimate_messages_tokens(messages) + EXPECTED_REPLY_TOKENS):
+                with _stage(trace, "llm", mode="blocking") as rec:
+                    rec.bytes_in = len(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+                    completion = await self._call(
+                        "chat", chat_pool, lambda client, deployment: client.chat.completions.create(model=deployment, messages=messages)
+                    )
+                    text = completion.choices[0].message.content or ""
+                    rec.bytes_out = len(text.encode("utf-8"))
+                    if completion.usage is not None:
+                        rec.tokens_in = completion.usage.prompt_tokens
+                        rec.tokens_out = completion.usage.completion_tokens
+                    return text
+        except asyncio.CancelledError:
+            self._cancelled("chat", "tokens", EXPECTED_REPLY_TOKENS)
+            raise
+
+    async def stream_chat(self, chat_pool: EndpointPool, messages: list[dict],
+                          trace: TurnTrace | None = None) -> AsyncIterator[str]:
+        """Yield content deltas from a streaming chat completion.
+
+        Failover happens while opening the stream; once deltas flow, the reply
+        stays on that endpoint.
+        """
+        received = 0
+        try:
+            async with self.slot("chat", _session(trace), estimate_messages_tokens(messages) + EXPECTED_REPLY_TOKENS):
+                with _stage(trace, "llm", mode="stream") as rec:
+                    rec.bytes_in = len(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+                    t0 = time.perf_counter()
+                    stream = await self._call(
+                        "chat", chat_pool, lambda client, deployment: client.chat.completions.create(model=deployment, messages=messages, stream=True)
+                    )
+                    try:
+                        async for chunk in stream:
+                            # Azure sends a leading chunk with empty choices (prompt filter results)
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                if not rec.tokens_out and trace is not None:
+                                    trace.mark("llm_first_token", time.perf_counter() - t0)
+                                # Each streamed delta carries roughly one token
+                                rec.tokens_out += 1
+                                received = rec.tokens_out
+                                rec.bytes_out += len(delta.encode("utf-8"))
+                                yield delta
+                    finally:
+                        # Release the connection even if the consumer stopped early
+                        await stream.close()
+        except asyncio.CancelledError:
+            # Closing the stream stops generation: the rest of the reply is never produced or billed
+            self._cancelled("chat", "tokens", EXPECTED_REPLY_TOKENS - received)
+            raise
+
+    async def fold_history(self, chat_pool: EndpointPool, conversation: Conversation,
+                           trace: TurnTrace | None = None) -> bool:
+        """Fold the conversation's oldest turns into its summary, if it is over budget.
+
+        Meant to run in the background after a turn; if the chat call fails the
+        conversation falls back to a local digest, so the budget still holds.
+        """
+        job = conversation.start_fold()
+        if job is None:
+            return False
+        summary = None
+        try:
+            async with self.slot("chat", _session(trace), estimate_messages_tokens(job.messages) + EXPECTED_REPLY_TOKENS):
+                with _stage(trace, "summarize") as rec:
+                    rec.tokens_in = estimate_messages_tokens(job.messages)
+                    completion = await self._call(
+                        "chat", chat_pool, lambda client, deployment: client.chat.completions.create(model=deployment, messages=job.messages)
+                    )
+                    summary = completion.choices[0].message.content
+        except Exception:
+            pass
+        finally:
+            conversation.finish_fold(job, summary)
+        return True
+
+    async def synthesize(self, tts_pool: EndpointPool, voice: str, text: str,
+                         cache: TTSCache | None = None, trace: TurnTrace | None = None, fmt: str = "mp3") -> bytes:
+        """Speech for ``text`` in ``fmt`` (see ``audio_format.FORMATS``), ready for a browser to play."""
+        audio_format = FORMATS[fmt]
+
+        async def _request(client, deployment: str) -> bytes:
+            response = await client.audio.speech.create(model=deployment, voice=voice, input=text, response_format=fmt)
+            return audio_format.playable(await response.aread())
+
+        async def _call() -> bytes:
+            try:
+                async with self.slot("tts", _session(trace)):
+                    return await self._call("tts", tts_pool, _request)
+            except asyncio.CancelledError:
+                # TTS is billed per input character
+                self._cancelled("tts", "chars", len(text))
+                raise
+
+        key = cache_key(tts_pool.deployment, voice, fmt, text) if cache is not None else None
+        if cache is not None:
+            t0 = time.perf_counter()
+            audio = await cache.aget(key)
+            if audio is not None:
+                # Timed apart from "tts", so cache hits don't pull its percentiles toward zero
+                if trace is not None:
+                    trace.mark("tts_cache_hit", time.perf_counter() - t0, format=fmt)
+                return audio
+        with _stage(trace, "tts", format=fmt) as rec:
+            rec.bytes_in = len(text.encode("utf-8"))
+            if cache is None:
+                audio = await _call()
+            else:
+                audio = await cache.aget_or_create(key, _call)
+            rec.bytes_out = len(audio)
+            return audio
+
+    async def synthesize_all(self, tts_pool: EndpointPool, voice: str, sentences: list[str],
+                             cache: TTSCache | None = None, trace: TurnTrace | None = None,
+                             fmt: str = "mp3") -> list[ReplySegment]:
+        """Synthesize already-known sentences concurrently, keeping their order."""
+        results = await asyncio.gather(
+            *(self.synthesize(tts_pool, voice, text, cache, trace, fmt) for text in sentences),
+            return_exceptions=True,
+        )
+        return [
+            ReplySegment(i, text, error=res) if isinstance(res, BaseException) else ReplySegment(i, text, audio=res)
+            for i, (text, res) in enumerate(zip(sentences, results))
+        ]
+
+    async def stream_reply_audio(
+        self,
+        chat_pool: EndpointPool,
+        tts_pool: EndpointPool,
+        voice: str,
+        messages: list[dict],
+        tts_cache: TTSCache | None = None,
+        trace: TurnTrace | None = None,
+        fmt: str = "mp3",
+    ) -> AsyncIterator[ReplySegment]:
+        """Stream a chat reply and yield it sentence by sentence with audio.
+
+        Each finished sentence gets its own TTS task immediately, so synthesis
+        of sentence N overlaps generation of sentence N+1; segments are still
+        yielded in order. Closing the iterator early cancels the chat stream
+        and any TTS still in flight.
+        """
+        ready: asyncio.Queue = asyncio.Queue()
+        done = object()
+        tasks: list[asyncio.Task] = []
+
+        async def _produce():
+            def _start(text: str):
+                task = asyncio.ensure_future(self.synthesize(tts_pool, voice, text, tts_cache, trace, fmt))
+                tasks.append(task)
+                ready.put_nowait((len(tasks) - 1, text, task))
+
+            try:
+                chunker = SentenceChunker()
+                async for delta in self.stream_chat(chat_pool, messages, trace):
+                    for text in chunker.feed(delta):
+                        _start(text)
+                for text in chunker.flush():
+                    _start(text)
+            except Exception as e:
+                ready.put_nowait(e)
+            finally:
+                ready.put_nowait(done)
+
+        producer = asyncio.ensure_future(_produce())
+        yielded = 0
+        try:
+            while True:
+                item = await ready.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                index, text, task = item
+                try:
+                    audio = await task
+                except Exception as e:
+                    yield ReplySegment(index, text, error=e)
+                else:
+                    yield ReplySegment(index, text, audio=audio)
+                yielded += 1
+        finally:
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+            # Sentences already synthesized but never played
+            discarded = sum(1 for task in tasks[yielded:] if task.done() and not task.cancelled())
+            if discarded:
+                self.registry.incr("segments_discarded_total", amount=discarded)
+
+    async def run_turn(
+        self,
+        pools: dict[str, EndpointPool],
+        audio_bytes: bytes,
+        voice: str = "nova",
+        mem: dict | None = None,
+        auto_lang: bool = True,
+        tts_cache: TTSCache | None = None,
+        trace: TurnTrace | None = None,
+        reply_cache: ReplyCache | None = None,
+        conversation: Conversation | None = None,
+    ) -> TurnResult:
+        """Run one STT → chat → TTS turn the way the app's streaming mode does.
+
+        ``pools`` maps "stt", "chat" and "tts" to endpoint pools. TTS failures
+        are collected per sentence rather than raised. A ``reply_cache`` hit
+        skips the chat call and only synthesizes the cached sentences. With a
+        ``conversation``, earlier turns are part of the prompt and the turn is
+        recorded afterwards; summarizing old turns is left running in the background.
+        """
+        with _stage(trace, "audio_prep") as rec:
+            # CPU-bound decode/resample/segmentation runs off the loop
+            segments = await asyncio.to_thread(segment_for_stt, audio_bytes)
+            rec.bytes_in, rec.bytes_out = len(audio_bytes), sum(len(p.data) for p in segments)
+        if len(segments) > 1:
+            transcript = await self.transcribe_segments(pools["stt"], segments, trace)
+        else:
+            transcript = await self.transcribe(pools["stt"], segments[0], trace)
+        with _stage(trace, "lang_detect"):
+            language = detect_language(transcript) if auto_lang else 'en'
+        with _stage(trace, "prompt_build") as rec:
+            system_hint = build_system_hint(language, mem or {})
+            if conversation is not None:
+                messages = conversation.messages(system_hint, transcript)
+            else:
+                messages = [
+                    {"role": "system", "content": system_hint},
+                    {"role": "user", "content": transcript},
+                ]
+            rec.tokens_in = estimate_messages_tokens(messages)
+        result = TurnResult(transcript, language, [], [], [])
+        reply_key = reply_cache.key(pools["chat"].deployment, messages) if reply_cache is not None else None
+        cached = reply_cache.get(reply_key) if reply_key is not None else None
+        if cached is not None:
+            segments = await self.synthesize_all(pools["tts"], voice, cached, tts_cache, trace)
+        else:
+            segments = [seg async for seg in self.stream_reply_audio(
+                pools["chat"], pools["tts"], voice, messages, tts_cache=tts_cache, trace=trace,
+            )]
+        for seg in segments:
+            result.sentences.append(seg.text)
+            result.audio.append(seg.audio)
+            if seg.error is not None:
+                result.errors.append(seg.error)
+        if cached is None and reply_key is not None:
+            reply_cache.put(reply_key, result.sentences)
+        if conversation is not None:
+            conversation.record(trace.turn_id if trace is not None else str(id(result)), transcript,
+                                " ".join(result.sentences))
+            self.spawn(self.fold_history(pools["chat"], conversation, trace))
+        return result
+
+
+# --- Shared loop + sync bridge ---
+_loop: asyncio.AbstractEventLoop | None = None
+_engine: VoiceEngine | None = None
+_loop_lock = threading.Lock()
+WAIT_POLL_S = 0.25
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """The process-wide engine loop, started on a daemon thread on first use."""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="voice-engine", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def get_engine() -> VoiceEngine:
+    global _engine
+    if _engine is None:
+        with _loop_lock:
+            if _engine is None:
+                _engine = VoiceEngine()
+    return _engine
+
+
+def run_sync(coro, timeout: float | None = None, on_wait=None, turn: Turn | None = None):
+    """Run a coroutine on the engine loop and block until it finishes.
+
+    ``on_wait()`` is called every ``WAIT_POLL_S`` while waiting (e.g. to show
+    the session's queue position). With a ``turn``, the coroutine is cancelled
+    along with it and ``TurnCancelled`` is raised here.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    if turn is not None:
+        turn.track(future)
+    try:
+        if on_wait is None:
+            return future.result(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return future.result(WAIT_POLL_S)
+            except concurrent.futures.TimeoutError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+                on_wait()
+    except concurrent.futures.CancelledError:
+        if turn is not None and turn.cancelled:
+            raise TurnCancelled(turn) from None
+        raise
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def submit(coro) -> concurrent.futures.Future:
+    """Start a coroutine on the engine loop without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def iter_sync(agen: AsyncIterator, on_wait=None, turn: Turn | None = None) -> Iterator:
+    """Consume an async iterator from synchronous code, item by item.
+
+    Items are pumped on the engine loop into a thread-safe queue. Closing the
+    returned generator (or an exception in the caller) cancels the pump, which
+    closes ``agen`` and whatever requests it has in flight. ``on_wait`` is
+    called periodically while no item is ready, as in ``run_sync``. With a
+    ``turn``, cancelling the turn does the same, drops the items still queued
+    and raises ``TurnCancelled`` here.
+    """
+    items: queue.Queue = queue.Queue()
+    done = object()
+
+    async def _pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    def _cancelled(pending: list) -> TurnCancelled:
+        discarded = sum(1 for item in pending if item is not done and not isinstance(item, Exception))
+        if discarded:
+            turn.registry.incr("segments_discarded_total", amount=discarded)
+        return TurnCancelled(turn)
+
+    future = asyncio.run_coroutine_threadsafe(_pump(), get_loop())
+    if turn is not None:
+        turn.track(future)
+    try:
+        while True:
+            try:
+                item = items.get(timeout=WAIT_POLL_S)
+            except queue.Empty:
+                # A pump cancelled before it started never queues ``done``; don't wait for it
+                if turn is not None and turn.cancelled:
+                    raise _cancelled(list(items.queue))
+                if future.done() and items.empty():
+                    future.result()  # raises what stopped the pump, if anything
+                    return
+                if on_wait is not None:
+                    on_wait()
+                continue
+            if turn is not None and turn.cancelled:
+                raise _cancelled(list(items.queue) + [item])
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if not future.done():
+            future.cancel()
@@ -0,0 +1,131 @@
+"""
+Script-based language detection for transcripts.
+
+One ``str.translate`` over a precomputed table does the per-character work
+in a single C-level pass: ASCII letters come out lower-cased, other Latin
+letters as "_", letters of the Indic scripts (Devanagari, Bengali, Gurmukhi,
+Gujarati, Oriya, Tamil, Telugu, Kannada, Malayalam) as one digit per script,
+and everything else as a space. The table covers the whole BMP and only
+produces ASCII, so an ``isascii`` check is all it takes to know the result
+is complete. Counting tags and splitting words on the result are C-level
+too, instead of one Python call per character. Dependent vowel signs count
+as letters of their script; digits and dandas don't count at all. Latin text is further
+split into English and Hinglish (Hindi written in Latin letters) by the share
+of common romanized Hindi words.
+"""
+# Script → language code; Devanagari is read as Hindi (Marathi and Nepali share it)
+SCRIPT_LANGUAGES = {
+    "deva": "hi",
+    "beng": "bn",
+    "guru": "pa",
+    "gujr": "gu",
+    "orya": "or",
+    "taml": "ta",
+    "telu": "te",
+    "knda": "kn",
+    "mlym": "ml",
+}
+LANGUAGE_NAMES = {
+    "en": "English",
+    "hi": "Hindi",
+    "hinglish": "Hinglish",
+    "bn": "Bengali",
+    "pa": "Punjabi",
+    "gu": "Gujarati",
+    "or": "Odia",
+    "ta": "Tamil",
+    "te": "Telugu",
+    "kn": "Kannada",
+    "ml": "Malayalam",
+}
+_RANGES = [
+    ("latn", 0x0041, 0x005A), ("latn", 0x0061, 0x007A), ("latn", 0x00C0, 0x024F), ("latn", 0x1E00, 0x1EFF),
+    ("deva", 0x0900, 0x097F), ("deva", 0xA8E0, 0xA8FF),
+    ("beng", 0x0980, 0x09FF), ("guru", 0x0A00, 0x0A7F), ("gujr", 0x0A80, 0x0AFF),
+    ("orya", 0x0B00, 0x0B7F), ("taml", 0x0B80, 0x0BFF), ("telu", 0x0C00, 0x0C7F),
+    ("knda", 0x0C80, 0x0CFF), ("mlym", 0x0D00, 0x0D7F),
+]
+# Dandas are shared by the Indic scripts, × and ÷ sit among the Latin letters; digits aren't letters
+_SHARED = {0x0964, 0x0965, 0x00D7, 0x00F7} | {block + d for block in range(0x0900, 0x0D80, 0x80) for d in range(0x66, 0x70)}
+# Each Indic script's tag is a digit: digits themselves map to separators, so they are free
+_TAGS = {script: str(i) for i, script in enumerate(dict.fromkeys(s for s, _, _ in _RANGES if s != "latn"))}
+_TAG_LANGUAGES = {tag: SCRIPT_LANGUAGES[script] for script, tag in _TAGS.items()}
+
+
+class _ScriptTable(dict):
+    """Code point → letter or script tag; anything not listed is a separator."""
+
+    def __missing__(self, cp: int) -> str:
+        return " "
+
+
+def _build_table() -> _ScriptTable:
+    table = _ScriptTable()
+    for script, lo, hi in _RANGES:
+        for cp in range(lo, hi + 1):
+            if cp in _SHARED:
+                continue
+            if script != "latn":
+                table[cp] = _TAGS[script]
+            elif cp < 0x80:
+                table[cp] = chr(cp).lower()
+            else:
+                # A letter, but never part of a romanized Hindi word
+                table[cp] = "_"
+    return table
+
+
+# The dict only serves text with characters beyond the BMP (emoji); ``str.translate``
+# indexes a list much faster, and characters past its end come through unchanged
+_FULL_TABLE = _build_table()
+_TABLE = [_FULL_TABLE[cp] for cp in range(0x10000)]
+
+# Common romanized Hindi words that are rare in English ("main", "the", "to" are left out on purpose)
+HINGLISH_WORDS = frozenset("""
+    aap aapka aapko aaj abhi acha accha achha agar apna apne aur bahut bata batao bataiye bhai bhi bohot
+    chahiye chalo dekho diya dost ek gaya gayi haan hai hain ham hamara hoga hona hoon hota hum humko
+    hun inka iska jaldi jab jaise jata jo kab kabhi kaha kahan kaise kaisa kaisi kal karna karo karte
+    kaun kitna kitne kripya kuch kya kyu kyun kyon lekin liye maine mausam mera meri mere mujhe mujhko
+    nahi nahin namaskar namaste paani pata phir raha rahe rahi sab sahi samajh shukriya tha thi theek
+    thik tum tumhara tumhe wala wale wali woh yaar yahan yeh
+""".split())
+
+
+# At least this share of letters in Indic scripts → the most used one (the old detector's 30%)
+INDIC_SHARE = 0.3
+# Latin text where this share of words are romanized Hindi → Hinglish
+HINGLISH_SHARE = 0.2
+
+
+def detect_language(text: str) -> str:
+    """Language code of a complete text: "en", "hinglish", or an Indic language ("hi", "ta", …).
+
+    Short transcripts are the common case, so per-call overhead matters:
+    Indic text returns before any word splitting, as soon as one script holds
+    most of the letters. Scripts with equal counts go to the one listed first
+    in ``SCRIPT_LANGUAGES``, whatever order the text uses them in.
+    """
+    mapped = text.translate(_TABLE)
+    if not mapped.isascii():
+        mapped = text.translate(_FULL_TABLE)
+    letters = len(mapped) - mapped.count(" ")
+    if not letters:
+        return "en"
+    if not text.isascii():
+        indic, best, best_language = 0, 0, ""
+        for tag, language in _TAG_LANGUAGES.items():
+            count = mapped.count(tag)
+            if count:
+                indic += count
+                if count > best:
+                    best, best_language = count, language
+                # A script with most of the letters is both over the share and the most used
+                if count * 2 > letters:
+                    break
+        if indic / letters >= INDIC_SHARE:
+            return best_language
+    words = mapped.split()
+    hinglish = sum(map(HINGLISH_WORDS.__contains__, words))
+    if hinglish >= 2 and hinglish / len(words) >= HINGLISH_SHARE:
+        return "hinglish"
+    return "en"
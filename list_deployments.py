@@ -23,7 +23,7 @@ headers = {
 }
 
 try:
-    response = requests.get(url, headers=headers)
+    response = requests.get(url, headers=headers, timeout=(5, 20))
     
     if response.status_code == 200:
         data = response.json()
@@ -0,0 +1,41 @@
+"""
+Serve reply audio to the browser by URL instead of inline data URLs.
+
+Clips are registered with Streamlit's media file manager, which serves them
+from ``/media/<id>`` with HTTP range support, so the player can start on the
+first bytes and the clip isn't re-sent over the websocket on every rerun.
+Files are tied to the session that added them: a clip stays available while
+each rerun re-registers it and is dropped once a rerun stops referencing it
+or the session ends. Streamlit's in-memory storage keeps a reference to the
+``bytes`` it is given rather than a copy, so a clip held in ``audio_buffers``
+is not stored a second time by being served.
+"""
+import base64
+
+
+def _base_url_path() -> str:
+    try:
+        import streamlit as st
+
+        base = (st.get_option("server.baseUrlPath") or "").strip("/")
+    except Exception:
+        base = ""
+    return f"/{base}" if base else ""
+
+
+def audio_url(data: bytes, mimetype: str, slot: str) -> str:
+    """Return a URL the avatar player can stream ``data`` from.
+
+    ``slot`` names the clip's place on the page (e.g. "reply.0"); registering
+    new audio under the same slot replaces the previous clip. Outside a
+    Streamlit server (bare ``python app.py``), falls back to a data URL.
+    """
+    try:
+        from streamlit import runtime
+
+        if runtime.exists():
+            url = runtime.get_instance().media_file_mgr.add(data, mimetype, f"voice-agent.{slot}")
+            return _base_url_path() + url if url.startswith("/") else url
+    except Exception:
+        pass
+    return f"data:{mimetype};base64," + base64.b64encode(data).decode("ascii")
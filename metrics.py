@@ -0,0 +1,278 @@
+"""
+Per-stage latency and payload instrumentation for the voice pipeline.
+
+Each turn gets a ``TurnTrace``; stages are timed with ``trace.stage(name)``,
+which records duration, request/response bytes, token counts and the error
+class (if any) into bounded rolling histograms on the process-wide
+``metrics`` registry. Results are available as percentiles for the
+Diagnostics panel, as Prometheus text (file and/or local HTTP endpoint) and,
+optionally, as one JSONL trace line per turn.
+"""
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from settings import get_env_or_secret, get_number
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RollingHistogram:
+    """Keeps the last ``window`` observations plus lifetime count and sum."""
+
+    def __init__(self, window: int):
+        self._values: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self._values.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantiles(self, qs=QUANTILES) -> list[float]:
+        values = sorted(self._values)
+        if not values:
+            return [0.0 for _ in qs]
+        # Nearest-rank percentile over the rolling window
+        return [values[min(len(values) - 1, int(q * len(values)))] for q in qs]
+
+
+@dataclass
+class StageRecord:
+    stage: str
+    started: float = 0.0
+    seconds: float = 0.0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    tokens_in: int = 0
+    tokens_out: int = 0
+    error: str = ""
+    labels: dict = field(default_factory=dict)
+
+
+class Metrics:
+    """Thread-safe registry of rolling stage histograms and counters."""
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self._lock = threading.Lock()
+        self._seconds: dict[str, RollingHistogram] = {}
+        self._bytes_in: dict[str, RollingHistogram] = {}
+        self._bytes_out: dict[str, RollingHistogram] = {}
+        self._counters: dict[tuple, float] = {}
+
+    def _hist(self, table: dict, stage: str) -> RollingHistogram:
+        hist = table.get(stage)
+        if hist is None:
+            hist = table[stage] = RollingHistogram(self.window)
+        return hist
+
+    def record(self, rec: StageRecord) -> None:
+        with self._lock:
+            self._hist(self._seconds, rec.stage).observe(rec.seconds)
+            if rec.bytes_in:
+                self._hist(self._bytes_in, rec.stage).observe(rec.bytes_in)
+            if rec.bytes_out:
+                self._hist(self._bytes_out, rec.stage).observe(rec.bytes_out)
+            if rec.tokens_in:
+                self._add(("tokens_total", rec.stage, "in"), rec.tokens_in)
+            if rec.tokens_out:
+                self._add(("tokens_total", rec.stage, "out"), rec.tokens_out)
+            if rec.error:
+                self._add(("errors_total", rec.stage, rec.error), 1)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Record a duration that isn't wrapped in a ``stage()`` block."""
+        with self._lock:
+            self._hist(self._seconds, stage).observe(seconds)
+
+    def incr(self, name: str, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._add((name, *labels), amount)
+
+    def _add(self, key: tuple, amount: float) -> None:
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter(self, name: str, *labels: str) -> float:
+        with self._lock:
+            return self._counters.get((name, *labels), 0)
+
+    def summary(self) -> list[dict]:
+        """One row per stage with count and p50/p95/p99 in milliseconds."""
+        rows = []
+        with self._lock:
+            for stage, hist in sorted(self._seconds.items()):
+                p50, p95, p99 = (v * 1000 for v in hist.quantiles())
+                bytes_out = self._bytes_out.get(stage)
+                rows.append({
+                    "stage": stage,
+                    "count": hist.count,
+                    "p50_ms": round(p50),
+                    "p95_ms": round(p95),
+                    "p99_ms": round(p99),
+                    "avg_out_kb": round(bytes_out.total / bytes_out.count / 1024, 1) if bytes_out and bytes_out.count else 0.0,
+                    "errors": sum(v for k, v in self._counters.items() if k[0] == "errors_total" and k[1] == stage),
+                })
+        return rows
+
+    def to_prometheus(self, prefix: str = "voice_agent") -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines: list[str] = []
+
+        def _summary(name: str, help_text: str, table: dict[str, RollingHistogram]):
+            if not table:
+                return
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} summary")
+            for stage, hist in sorted(table.items()):
+                for q, v in zip(QUANTILES, hist.quantiles()):
+                    lines.append(f'{prefix}_{name}{{stage="{stage}",quantile="{q}"}} {v:.6g}')
+                lines.append(f'{prefix}_{name}_sum{{stage="{stage}"}} {hist.total:.6g}')
+                lines.append(f'{prefix}_{name}_count{{stage="{stage}"}} {hist.count}')
+
+        with self._lock:
+            _summary("stage_seconds", "Pipeline stage latency.", self._seconds)
+            _summary("stage_request_bytes", "Bytes sent to a pipeline stage.", self._bytes_in)
+            _summary("stage_response_bytes", "Bytes returned by a pipeline stage.", self._bytes_out)
+            by_name: dict[str, list[tuple]] = {}
+            for key, value in sorted(self._counters.items()):
+                by_name.setdefault(key[0], []).append((key[1:], value))
+        label_names = {
+            "tokens_total": ("stage", "direction"),
+            "errors_total": ("stage", "error"),
+            "reply_cache_total": ("result",),
+            "admission_total": ("service", "result"),
+            "retries_total": ("service", "error"),
+            "cancelled_total": ("service",),
+            "cancel_saved_total": ("service", "unit"),
+            "turns_cancelled_total": ("reason",),
+        }
+        for name, entries in by_name.items():
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for labels, value in entries:
+                names = label_names.get(name, tuple(f"l{i}" for i in range(len(labels))))
+                rendered = ",".join(f'{n}="{v}"' for n, v in zip(names, labels))
+                lines.append(f"{prefix}_{name}{{{rendered}}} {value:g}" if rendered else f"{prefix}_{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+class TurnTrace:
+    """Stage records for one voice turn; feeds the shared registry as it goes."""
+
+    def __init__(self, registry: Metrics, session_id: str = ""):
+        self.registry = registry
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.started = time.time()
+        self.records: list[StageRecord] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, **labels):
+        """Time a block; set ``bytes_*``/``tokens_*`` on the yielded record."""
+        rec = StageRecord(stage=name, started=time.time(), labels=labels)
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        except (Exception, asyncio.CancelledError) as e:
+            rec.error = type(e).__name__
+            raise
+        finally:
+            rec.seconds = time.perf_counter() - t0
+            with self._lock:
+                self.records.append(rec)
+            self.registry.record(rec)
+
+    def mark(self, name: str, seconds: float, **labels) -> None:
+        """Record a point measurement such as time-to-first-token."""
+        rec = StageRecord(stage=name, started=time.time(), seconds=seconds, labels=labels)
+        with self._lock:
+            self.records.append(rec)
+        self.registry.record(rec)
+
+    def finish(self) -> None:
+        """Write the turn's JSONL trace and refresh the Prometheus file, if configured."""
+        trace_path = get_env_or_secret("METRICS_TRACE_PATH")
+        if trace_path:
+            line = json.dumps({
+                "turn_id": self.turn_id,
+                "session_id": self.session_id,
+                "started": self.started,
+                "seconds": time.time() - self.started,
+                "stages": [asdict(r) for r in self.records],
+            }, ensure_ascii=False)
+            try:
+                with _trace_lock, open(trace_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError:
+                pass
+        write_prometheus_file(self.registry)
+
+
+_trace_lock = threading.Lock()
+metrics = Metrics(window=int(get_number("METRICS_WINDOW", 1024)))
+
+
+def start_turn(session_id: str = "") -> TurnTrace:
+    start_exporter()
+    return TurnTrace(metrics, session_id)
+
+
+def write_prometheus_file(registry: Metrics = metrics) -> None:
+    path = get_env_or_secret("METRICS_PROM_PATH")
+    if not path:
+        return
+    try:
+        # Atomic replace so a scraper never reads a half-written file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(registry.to_prometheus())
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+# --- Local /metrics endpoint ---
+_exporter: ThreadingHTTPServer | None = None
+_exporter_lock = threading.Lock()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exporter() -> None:
+    """Serve /metrics on METRICS_PORT (bound to METRICS_HOST) once per process."""
+    global _exporter
+    port = int(get_number("METRICS_PORT", 0))
+    if not port or _exporter is not None:
+        return
+    with _exporter_lock:
+        if _exporter is not None:
+            return
+        try:
+            _exporter = ThreadingHTTPServer((get_env_or_secret("METRICS_HOST", "127.0.0.1"), port), _MetricsHandler)
+        except OSError:
+            return
+        threading.Thread(target=_exporter.serve_forever, name="metrics-exporter", daemon=True).start()
@@ -0,0 +1,260 @@
+"""
+Local stand-in for the Azure OpenAI endpoints the voice pipeline calls.
+
+Implements Whisper transcription, chat completions (blocking and streamed
+SSE) and speech synthesis with configurable latency distributions, token
+rates, payload sizes and injected 429/5xx errors, so the pipeline can be
+load-tested offline. Run standalone:
+
+    python mock_azure.py --port 8765 --error-429-rate 0.05
+
+then point AZURE_OPENAI_ENDPOINT at http://127.0.0.1:8765/ (any key and API
+version are accepted). ``bench_pipeline.py`` starts one in-process.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from audio_format import FORMATS
+
+# Leading bytes of each format, so clients can tell them apart
+_MAGIC = {"mp3": b"ID3\x04\x00\x00\x00\x00\x00\x00", "opus": b"OggS\x00\x02", "aac": b"\xff\xf1\x50\x80", "pcm": b""}
+
+_ROUTE = re.compile(r"^/openai/deployments/(?P<deployment>[^/]+)/(?P<op>audio/transcriptions|audio/speech|chat/completions)$")
+
+REPLY_EN = (
+    "Sure, happy to help with that. The short answer is yes, and here is why. "
+    "It mostly depends on what you need today, so tell me a bit more. "
+)
+REPLY_HI = "ज़रूर, मैं मदद कर सकती हूँ। आज आपको क्या जानना है? मुझे थोड़ा और बताइए। "
+
+
+@dataclass
+class MockConfig:
+    # Latencies are lognormal: the median in ms and the sigma of the underlying normal
+    stt_median_ms: float = 350
+    stt_sigma: float = 0.35
+    chat_first_token_ms: float = 400
+    chat_sigma: float = 0.4
+    chat_tokens_per_s: float = 60
+    chat_reply_tokens: int = 60
+    tts_median_ms: float = 250
+    tts_sigma: float = 0.3
+    tts_bytes_per_char: int = 350
+    error_429_rate: float = 0.0
+    error_5xx_rate: float = 0.0
+    retry_after_s: float = 1.0
+    # Requests per minute per operation, enforced over 10 s windows like Azure (0 = unlimited)
+    quota_rpm: float = 0.0
+    transcript: str = "namaste, aaj ka mausam kaisa hai?"
+    reply_language: str = "en"
+    # Comma-separated deployment names that exist (empty = any name works)
+    deployments: str = ""
+    seed: int | None = None
+
+
+class MockAzureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: MockConfig):
+        super().__init__(address, _Handler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.rng_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats: dict[str, int] = {}
+        self.quota_lock = threading.Lock()
+        self.accepted: dict[str, deque] = {}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def count(self, key: str) -> None:
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def lognormal_s(self, median_ms: float, sigma: float) -> float:
+        with self.rng_lock:
+            return self.rng.lognormvariate(math.log(max(median_ms, 0.001)), sigma) / 1000
+
+    def over_quota(self, op: str) -> float | None:
+        """Seconds until ``op`` has quota again, or None if this request fits."""
+        quota = self.config.quota_rpm / 6
+        if quota <= 0:
+            return None
+        now = time.monotonic()
+        with self.quota_lock:
+            window = self.accepted.setdefault(op, deque())
+            while window and window[0] <= now - 10:
+                window.popleft()
+            if len(window) >= quota:
+                return window[0] + 10 - now
+            window.append(now)
+        return None
+
+    def roll(self) -> float:
+        with self.rng_lock:
+            return self.rng.random()
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is normal, not an error
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients keep connections alive, like the real service
+    protocol_version = "HTTP/1.1"
+    server: MockAzureServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        m = _ROUTE.match(self.path.split("?")[0])
+        if m is None:
+            self._json(404, {"error": {"code": "DeploymentNotFound", "message": self.path}})
+            return
+        op, cfg = m["op"], self.server.config
+        self.server.count(op)
+        if cfg.deployments and m["deployment"] not in cfg.deployments.split(","):
+            self._json(404, {"error": {"code": "DeploymentNotFound",
+                                       "message": f"The API deployment {m['deployment']} does not exist."}})
+            return
+        if self._inject_error(op, cfg):
+            return
+        if op == "audio/transcriptions":
+            time.sleep(self.server.lognormal_s(cfg.stt_median_ms, cfg.stt_sigma))
+            self._json(200, {"text": cfg.transcript})
+        elif op == "audio/speech":
+            req = json.loads(body or b"{}")
+            text, fmt = req.get("input", ""), FORMATS.get(req.get("response_format") or "mp3", FORMATS["mp3"])
+            time.sleep(self.server.lognormal_s(cfg.tts_median_ms, cfg.tts_sigma))
+            # Fake audio: the format's magic bytes, then filler sized like real speech (tts_bytes_per_char is for MP3)
+            size = int(len(text) * cfg.tts_bytes_per_char * fmt.nominal_kbps / FORMATS["mp3"].nominal_kbps)
+            audio = _MAGIC[fmt.name] + b"\x00" * size
+            self._send(200, audio, "audio/L16" if fmt.name == "pcm" else fmt.mimetype)
+        else:
+            self._chat(json.loads(body or b"{}"), m["deployment"], cfg)
+
+    def _inject_error(self, op: str, cfg: MockConfig) -> bool:
+        wait = self.server.over_quota(op)
+        if wait is not None:
+            self.server.count("429")
+            self._json(429, {"error": {"code": "429", "message": "Requests exceed the deployment's rate limit."}},
+                       {"Retry-After": str(math.ceil(wait)), "retry-after-ms": str(int(wait * 1000))})
+            return True
+        roll = self.server.roll()
+        if roll < cfg.error_429_rate:
+            self.server.count("429")
+            self._json(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                       {"Retry-After": f"{cfg.retry_after_s:g}", "retry-after-ms": str(int(cfg.retry_after_s * 1000))})
+            return True
+        if roll < cfg.error_429_rate + cfg.error_5xx_rate:
+            self.server.count("5xx")
+            self._json(503, {"error": {"code": "ServiceUnavailable", "message": "Injected failure."}})
+            return True
+        return False
+
+    def _chat(self, req: dict, deployment: str, cfg: MockConfig):
+        reply = REPLY_HI if cfg.reply_language == "hi" else REPLY_EN
+        words = (reply * (cfg.chat_reply_tokens // max(len(reply.split()), 1) + 1)).split()[:cfg.chat_reply_tokens]
+        tokens = [w + " " for w in words]
+        prompt_tokens = sum(len(str(msg.get("content", ""))) for msg in req.get("messages", [])) // 4
+        time.sleep(self.server.lognormal_s(cfg.chat_first_token_ms, cfg.chat_sigma))
+        base = {"id": "chatcmpl-" + uuid.uuid4().hex[:12], "created": int(time.time()), "model": deployment}
+        if not req.get("stream"):
+            time.sleep(len(tokens) / cfg.chat_tokens_per_s)
+            self._json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens).strip()}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens + len(tokens)},
+            })
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            # Azure opens with a chunk carrying only prompt filter results
+            self._event({**base, "object": "chat.completion.chunk", "choices": [], "prompt_filter_results": []})
+            for i, tok in enumerate(tokens):
+                if i:
+                    time.sleep(1 / cfg.chat_tokens_per_s)
+                self._event({**base, "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}]})
+            self._event({**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away mid-stream (e.g. a cancelled turn)
+            self.server.count("stream_aborted")
+            self.close_connection = True
+
+    def _event(self, payload: dict):
+        self._chunk(b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n")
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, status: int, payload: dict, headers: dict | None = None):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json", headers)
+
+    def _send(self, status: int, data: bytes, content_type: str, headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_mock_server(config: MockConfig | None = None, host: str = "127.0.0.1", port: int = 0) -> MockAzureServer:
+    """Start the mock on a background thread; ``port=0`` picks a free port."""
+    server = MockAzureServer((host, port), config or MockConfig())
+    threading.Thread(target=server.serve_forever, name="mock-azure", daemon=True).start()
+    return server
+
+
+def add_config_args(parser: argparse.ArgumentParser) -> None:
+    """Expose every MockConfig field as a --dashed-option."""
+    for f in fields(MockConfig):
+        # Only "seed" is optional (int | None)
+        kind = f.type if f.type in (float, int, str) else int
+        parser.add_argument("--" + f.name.replace("_", "-"), type=kind, default=f.default)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(**{f.name: getattr(args, f.name) for f in fields(MockConfig)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_args(parser)
+    args = parser.parse_args()
+    server = MockAzureServer((args.host, args.port), config_from_args(args))
+    print(f"Mock Azure OpenAI listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
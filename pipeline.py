@@ -0,0 +1,148 @@
+"""
+Voice pipeline helpers: prompt building, sentence chunking of streamed chat
+output, result types and a per-session memo of stage results. Language
+detection lives in ``lang_detect.py``, the network stages in ``engine.py``.
+"""
+import hashlib
+import re
+from dataclasses import dataclass
+
+from lang_detect import LANGUAGE_NAMES
+
+# --- System prompt ---
+BASE_HINT = "You are a helpful voice assistant. Reply in {language}. Keep responses concise and conversational."
+LANGUAGE_CLAUSES = {
+    "hinglish": " Use Hinglish: conversational Hindi written in Latin letters, mixing in English words the way the user does.",
+}
+STYLE_CLAUSES = {
+    "normal": "",
+    "slower": " Speak a bit slower and clearer.",
+    "faster": " Speak a bit faster and energetic.",
+}
+
+
+def build_system_hint(lang: str, mem: dict) -> str:
+    """Build the system prompt from the reply language and saved preferences."""
+    name_clause = f" Address the user as {mem['preferred_name']}." if mem.get("preferred_name") else ""
+    style_clause = STYLE_CLAUSES.get(mem.get("speak_style", "normal"), "")
+    language = BASE_HINT.format(language=LANGUAGE_NAMES.get(lang, "English")) + LANGUAGE_CLAUSES.get(lang, "")
+    return language + name_clause + style_clause
+
+
+# --- Sentence chunking ---
+# A sentence ends at a Hindi danda (।/॥), which needs no trailing space, or at
+# English terminal punctuation followed by whitespace (so "3.5" or "e.g.x" don't
+# split mid-token), or at a newline.
+_SENTENCE_END = re.compile(r"[।॥]+[\"'”’)]*\s*|[.!?…]+[\"'”’)]*\s+|\n+")
+# A period after a title or an initial ("Dr.", "Mr.", "J.") is not a sentence end
+_ABBREVIATION = re.compile(r"(?:\b(?:Dr|Mr|Mrs|Ms|Prof|Sr|Jr|St|Mt|No|vs|etc|approx)|(?<![\w.])[A-Z])\.\s*$")
+# Soft break points used when a sentence runs past max_chars
+_SOFT_BREAK = re.compile(r"[,;:،]\s+|\s+")
+
+
+class SentenceChunker:
+    """Incrementally split streamed text into speakable sentences.
+
+    Fragments shorter than ``min_chars`` are held back and merged with the next
+    sentence so TTS isn't called for a lone "Hi." mid-reply; the very first
+    sentence is exempt so the first audio starts as early as possible. No
+    sentence ends on a title or an initial, so "Dr. Rao" stays in one clip.
+    """
+
+    def __init__(self, min_chars: int = 24, max_chars: int = 280):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buf = ""
+        self._emitted = 0
+
+    def feed(self, delta: str) -> list[str]:
+        """Add streamed text and return any sentences that are now complete."""
+        self._buf += delta
+        out: list[str] = []
+        start = 0
+        for m in _SENTENCE_END.finditer(self._buf):
+            candidate = self._buf[start:m.end()].strip()
+            if self._emitted and len(candidate) < self.min_chars or _ABBREVIATION.search(candidate):
+                continue
+            if candidate:
+                out.append(candidate)
+                self._emitted += 1
+            start = m.end()
+        self._buf = self._buf[start:]
+        while len(self._buf) > self.max_chars:
+            cut = self._soft_cut(self._buf)
+            out.append(self._buf[:cut].strip())
+            self._emitted += 1
+            self._buf = self._buf[cut:]
+        return out
+
+    def flush(self) -> list[str]:
+        """Return whatever text is left once the stream has ended."""
+        rest = self._buf.strip()
+        self._buf = ""
+        if not rest:
+            return []
+        self._emitted += 1
+        return [rest]
+
+    def _soft_cut(self, text: str) -> int:
+        cut = 0
+        for m in _SOFT_BREAK.finditer(text, 0, self.max_chars):
+            cut = m.end()
+        return cut or self.max_chars
+
+
+# --- Results ---
+@dataclass
+class ReplySegment:
+    index: int
+    text: str
+    audio: bytes | None = None
+    error: BaseException | None = None
+
+
+@dataclass
+class TurnResult:
+    transcript: str
+    language: str
+    sentences: list[str]
+    audio: list[bytes | None]
+    errors: list[Exception]
+
+
+# --- Per-session stage memo ---
+def stage_key(*parts) -> str:
+    """Digest the inputs of a pipeline stage into a short cache key."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            h.update(part)
+        else:
+            h.update(repr(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()[:32]
+
+
+class TurnCache:
+    """Last result of each pipeline stage, keyed by a digest of its inputs.
+
+    Streamlit reruns the whole script on every widget change while
+    ``mic_recorder`` keeps returning the same clip; keeping one entry per
+    stage lets a rerun recompute only the stages whose inputs changed.
+    """
+
+    def __init__(self):
+        self._stages: dict[str, tuple[str, object]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, stage: str, key: str):
+        entry = self._stages.get(stage)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, stage: str, key: str, value) -> None:
+        self._stages[stage] = (key, value)
@@ -0,0 +1,215 @@
+"""
+Per-user preference store (preferred name, speaking style, …).
+
+Preferences used to live in one ``memory.json`` shared by every session and
+rewritten in full on each save. The store keys preferences by user, caches
+reads in process and hands writes to a background thread that commits them
+in batches, one transaction per batch. The default backend is SQLite in WAL
+mode, so readers never block the writer and a crash can't leave a
+half-written file. An existing ``memory.json`` is imported once, and its
+non-identifying fields (``SHARED_PREFS``: the speaking style, never the
+name) serve as defaults for users who haven't saved anything yet.
+"""
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from settings import get_env_or_secret, get_number
+
+DEFAULT_PREFS = {
+    "preferred_name": "",
+    "speak_style": "normal",  # normal | slower | faster
+}
+# The legacy file was shared by everyone, so only fields that say nothing about a person carry over
+SHARED_PREFS = ("speak_style",)
+LEGACY_USER = "__legacy__"
+LEGACY_JSON = Path(__file__).parent / "memory.json"
+
+
+class PreferenceStore:
+    """In-memory store; the base for persistent backends.
+
+    ``get`` returns a copy of the user's preferences merged over the
+    defaults; ``set`` replaces them. Backends override ``_load``/``_write``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache: dict[str, dict] = {}
+        self.stats = {"reads": 0, "cache_hits": 0, "writes": 0, "batches": 0, "write_errors": 0}
+        self.last_error = ""
+
+    def get(self, user_id: str) -> dict:
+        with self._lock:
+            self.stats["reads"] += 1
+            cached = self._cache.get(user_id)
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                return dict(cached)
+        prefs = {**DEFAULT_PREFS, **self._defaults(), **(self._load(user_id) or {})}
+        with self._lock:
+            # A set() that raced this read wins
+            prefs = self._cache.setdefault(user_id, prefs)
+        return dict(prefs)
+
+    def set(self, user_id: str, prefs: dict) -> None:
+        with self._lock:
+            self._cache[user_id] = dict(prefs)
+            self.stats["writes"] += 1
+        self._write(user_id, dict(prefs))
+
+    def flush(self) -> None:
+        """Block until queued writes are committed."""
+
+    def close(self) -> None:
+        self.flush()
+
+    def _defaults(self) -> dict:
+        return {}
+
+    def _load(self, user_id: str) -> dict | None:
+        return None
+
+    def _write(self, user_id: str, prefs: dict) -> None:
+        pass
+
+
+class SQLitePreferenceStore(PreferenceStore):
+    """SQLite (WAL) backend with write-behind batching."""
+
+    def __init__(self, path: Path, flush_interval_s: float = 0.5, legacy_json: Path | None = LEGACY_JSON):
+        super().__init__()
+        self.path = path
+        self.flush_interval_s = flush_interval_s
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS prefs (user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+        self._pending: dict[str, dict] = {}
+        self._pending_cv = threading.Condition()
+        self._inflight = 0
+        self._closed = False
+        if legacy_json is not None:
+            self._migrate(legacy_json)
+        # Filtered here too: databases migrated before SHARED_PREFS existed hold the whole legacy file
+        self._legacy = {k: v for k, v in (self._load(LEGACY_USER) or {}).items() if k in SHARED_PREFS}
+        self._writer = threading.Thread(target=self._run_writer, name="prefs-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _defaults(self) -> dict:
+        return self._legacy
+
+    def _load(self, user_id: str) -> dict | None:
+        with self._db_lock:
+            row = self._db.execute("SELECT data FROM prefs WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+    def _write(self, user_id: str, prefs: dict) -> None:
+        with self._pending_cv:
+            # Later saves for the same user replace earlier ones still in the queue
+            self._pending[user_id] = prefs
+            self._pending_cv.notify()
+
+    def _run_writer(self) -> None:
+        while True:
+            with self._pending_cv:
+                while not self._pending and not self._closed:
+                    self._pending_cv.wait()
+                if not self._pending and self._closed:
+                    return
+            # Let a burst of saves accumulate into one transaction
+            time.sleep(self.flush_interval_s)
+            with self._pending_cv:
+                batch, self._pending = self._pending, {}
+                self._inflight = len(batch)
+            self._commit(batch)
+            with self._pending_cv:
+                self._inflight = 0
+                self._pending_cv.notify_all()
+
+    def _commit(self, batch: dict[str, dict]) -> None:
+        now = time.time()
+        rows = [(uid, json.dumps(prefs, ensure_ascii=False), now) for uid, prefs in batch.items()]
+        try:
+            with self._db_lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._db.executemany(
+                        "INSERT INTO prefs (user_id, data, updated) VALUES (?, ?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                        rows,
+                    )
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+            with self._lock:
+                self.stats["batches"] += 1
+        except sqlite3.Error as e:
+            with self._lock:
+                self.stats["write_errors"] += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+
+    def flush(self) -> None:
+        with self._pending_cv:
+            while (self._pending or self._inflight) and self._writer.is_alive():
+                self._pending_cv.wait(timeout=1.0)
+
+    def close(self) -> None:
+        with self._pending_cv:
+            if self._closed:
+                return
+            self._closed = True
+            self._pending_cv.notify_all()
+        self.flush()
+        self._writer.join(timeout=5.0)
+        with self._db_lock:
+            self._db.close()
+
+    def _migrate(self, legacy_json: Path) -> None:
+        """Import the old shared memory.json once; its ``SHARED_PREFS`` become every user's defaults."""
+        if not legacy_json.exists() or self._load(LEGACY_USER) is not None:
+            return
+        try:
+            with open(legacy_json, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict):
+            self._commit({LEGACY_USER: {k: data[k] for k in SHARED_PREFS if k in data}})
+
+    def count(self) -> int:
+        with self._db_lock:
+            return self._db.execute("SELECT COUNT(*) FROM prefs WHERE user_id != ?", (LEGACY_USER,)).fetchone()[0]
+
+
+_store: PreferenceStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_prefs_store() -> PreferenceStore:
+    """Process-wide store chosen by PREFS_BACKEND ("sqlite", the default, or "memory")."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if (get_env_or_secret("PREFS_BACKEND", "sqlite") or "sqlite").lower() == "memory":
+                    _store = PreferenceStore()
+                else:
+                    path = get_env_or_secret("PREFS_DB_PATH", str(Path(__file__).parent / ".data" / "prefs.sqlite3"))
+                    _store = SQLitePreferenceStore(Path(path), flush_interval_s=get_number("PREFS_FLUSH_MS", 500) / 1000)
+    return _store
@@ -0,0 +1,41 @@
+"""
+Token-bucket rate limiting for requests on the engine loop.
+
+Azure quotas are per minute (RPM/TPM), but they are enforced over short
+windows, so a bucket that refills continuously and only saves up about a
+second's worth of tokens keeps a client under quota without bursting into
+429s.
+"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """``rate`` tokens per second, at most ``burst`` saved up; waiters are served in order."""
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, per_minute: float, burst: float | None = None) -> "TokenBucket":
+        return cls(per_minute / 60.0, burst)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """Wait until ``amount`` tokens are available and take them; returns seconds waited."""
+        amount = min(amount, self.capacity)
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                self._refill(time.monotonic())
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return time.monotonic() - started
+                await asyncio.sleep((amount - self.tokens) / self.rate)
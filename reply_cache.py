@@ -0,0 +1,136 @@
+"""
+Cache of chat replies for repeated questions.
+
+Users ask the same short things again and again ("namaste", "what can you
+do?"). A reply is reusable when the deployment, every prompt message and the
+user's transcript match; the transcript is compared in a normalized form
+(case, whitespace, punctuation and common Devanagari spelling variants), so
+Whisper's small transcription differences still hit. Entries expire after a
+TTL and the cache is bounded by entry count. Questions whose answer depends
+on the moment (time, date, weather, news…) bypass the cache.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from metrics import Metrics, metrics
+from settings import get_env_or_secret, get_number
+
+# Folded when comparing transcripts: nukta dropped, chandrabindu → anusvara,
+# zero-width joiners removed (Whisper is inconsistent about all three)
+_DEVANAGARI_FOLD = str.maketrans({"़": None, "ँ": "ं", "‌": None, "‍": None})
+_WS = re.compile(r"\s+")
+
+# Answers that go stale: clock, calendar, weather, news, prices, scores
+DEFAULT_BYPASS = (
+    r"\b(time|clock|today|tonight|tomorrow|yesterday|now|date|day is it|weather|temperature|forecast"
+    r"|news|latest|current|price|stock|score)\b"
+    r"|\b(samay|baje|aaj|kal|abhi|mausam|khabar)\b"
+    r"|समय|बजे|आज|कल|अभी|मौसम|तापमान|ख़बर|खबर|समाचार|तारीख"
+)
+
+
+def normalize_transcript(text: str) -> str:
+    """Comparison form of a transcript: NFKC, casefolded, no punctuation, single spaces."""
+    text = unicodedata.normalize("NFKC", text).translate(_DEVANAGARI_FOLD).casefold()
+    # Drop punctuation (including the danda) and symbols; keep letters, marks and digits
+    text = "".join(" " if unicodedata.category(ch)[0] in "PSZ" else ch for ch in text)
+    return _WS.sub(" ", text).strip()
+
+
+class ReplyCache:
+    """TTL + LRU cache of reply sentences keyed by deployment and prompt."""
+
+    def __init__(self, ttl_s: float, max_entries: int, bypass: str | None = DEFAULT_BYPASS,
+                 registry: Metrics | None = None):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.bypass = re.compile(bypass, re.IGNORECASE) if bypass else None
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, tuple[str, ...]]] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "bypassed": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls) -> "ReplyCache":
+        extra = get_env_or_secret("REPLY_CACHE_BYPASS")
+        return cls(
+            ttl_s=get_number("REPLY_CACHE_TTL_S", 3600),
+            max_entries=int(get_number("REPLY_CACHE_MAX_ENTRIES", 2048)),
+            bypass=DEFAULT_BYPASS + ("|" + extra if extra else ""),
+            registry=metrics,
+        )
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            self.stats[outcome] += 1
+        if self.registry is not None:
+            self.registry.incr("reply_cache_total", outcome)
+
+    def key(self, deployment: str, messages: list[dict]) -> str | None:
+        """Cache key for a chat request, or None if its answer is time-sensitive.
+
+        The final user message is normalized; everything before it (system
+        prompt, earlier turns) must match exactly.
+        """
+        *context, last = messages
+        question = normalize_transcript(str(last.get("content", "")))
+        if not question or (self.bypass is not None and self.bypass.search(question)):
+            self._count("bypassed")
+            return None
+        raw = json.dumps([deployment, context, question], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> list[str] | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry, outcome = None, "expired"
+            elif entry is None:
+                outcome = "misses"
+            else:
+                self._entries.move_to_end(key)
+                outcome = "hits"
+        self._count(outcome)
+        return list(entry[1]) if entry is not None else None
+
+    def put(self, key: str, sentences: list[str]) -> None:
+        if not any(s.strip() for s in sentences):
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_s, tuple(sentences))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"] + self.stats["expired"]
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            }
+
+
+_cache: ReplyCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_reply_cache() -> ReplyCache | None:
+    """Process-wide reply cache, or None when disabled with REPLY_CACHE_ENABLED=0."""
+    global _cache
+    if (get_env_or_secret("REPLY_CACHE_ENABLED", "1") or "1").lower() in ("0", "false", "no"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ReplyCache.from_env()
+    return _cache
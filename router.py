@@ -0,0 +1,258 @@
+"""
+Multi-endpoint routing for the chat, Whisper and TTS services.
+
+Each service can be backed by a pool of Azure endpoints/deployments (e.g.
+the same model in several regions). The router keeps a live health score per
+endpoint (EWMA latency, EWMA error rate, ``Retry-After`` backoff), sends each
+request to the best-scoring healthy endpoint, fails over on throttling or
+server errors, and can hedge a slow request by racing a second endpoint.
+
+Pools are configured with ``AZURE_OPENAI_<SERVICE>_POOL``, a JSON list:
+
+    [{"endpoint": "https://eastus.../", "api_key": "...", "deployment": "gpt-4o"},
+     {"endpoint": "https://swedencentral.../", "api_key": "..."}]
+
+Missing fields fall back to the service's usual single-endpoint settings.
+Without a pool, each service is a pool of one, using the deployment and API
+version validated by ``discovery.py`` when its cache is fresh.
+"""
+import asyncio
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import openai
+
+from clients import async_client_for
+from discovery import cached_service
+from settings import CHAT_PREFIX, STT_PREFIX, TTS_PREFIX, ServiceConfig, get_env_or_secret, get_number, resolve_pool
+
+SERVICE_PREFIXES = {"chat": CHAT_PREFIX, "stt": STT_PREFIX, "tts": TTS_PREFIX}
+DEFAULT_DEPLOYMENTS = {"chat": "gpt-4", "stt": "whisper", "tts": "tts"}
+
+
+class NoHealthyEndpoint(RuntimeError):
+    pass
+
+
+@dataclass
+class Endpoint:
+    config: ServiceConfig
+    deployment: str
+    client: object = None
+    ewma_latency: float = 0.0
+    ewma_error: float = 0.0
+    blocked_until: float = 0.0
+    inflight: int = 0
+    requests: int = 0
+    errors: int = 0
+    hedges: int = 0
+    last_error: str = ""
+
+    @property
+    def name(self) -> str:
+        host = urlparse(self.config.endpoint or "").netloc or (self.config.endpoint or "?")
+        # "myres-eastus.openai.azure.com" → "myres-eastus"; keep IPs/ports whole
+        label = host if host[:1].isdigit() or host.startswith("localhost") else host.split(".")[0]
+        return f"{label}/{self.deployment}"
+
+    def score(self, now: float) -> float:
+        """Lower is better: expected latency, inflated by recent errors and load."""
+        penalty = 1.0 + 4.0 * self.ewma_error + 0.25 * self.inflight
+        return self.ewma_latency * penalty + (1e6 if now < self.blocked_until else 0.0)
+
+
+def retry_after(exc: Exception) -> float | None:
+    """The server's ``Retry-After`` (or ``retry-after-ms``) in seconds, if it sent one."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _should_fail_over(exc: Exception) -> bool:
+    """Throttling, server and network errors are the endpoint's fault; a 400 is ours."""
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500 or exc.status_code in (401, 403, 404, 408, 409)
+    return False
+
+
+def _discard(task: asyncio.Future) -> None:
+    """Close a hedged request's result if it finished after the winner (e.g. an open stream)."""
+    if task.cancelled() or task.exception() is not None:
+        return
+    close = getattr(task.result(), "close", None)
+    if close is not None:
+        result = close()
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+
+class EndpointPool:
+    """Health-scored pool of endpoints serving one service."""
+
+    def __init__(self, service: str, endpoints: list[Endpoint], hedge_after_s: float = 0.0, alpha: float = 0.2):
+        if not endpoints:
+            raise ValueError(f"empty endpoint pool for {service}")
+        self.service = service
+        self.endpoints = endpoints
+        self.hedge_after_s = hedge_after_s
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    @property
+    def deployment(self) -> str:
+        """Deployment name of the primary entry; identifies the model in cache keys."""
+        return self.endpoints[0].deployment
+
+    def ranked(self) -> list[Endpoint]:
+        now = time.monotonic()
+        with self._lock:
+            return sorted(self.endpoints, key=lambda ep: ep.score(now))
+
+    def _record(self, ep: Endpoint, seconds: float | None, exc: Exception | None) -> None:
+        a = self.alpha
+        with self._lock:
+            ep.requests += 1
+            if exc is None:
+                ep.ewma_latency = seconds if ep.ewma_latency == 0.0 else (1 - a) * ep.ewma_latency + a * seconds
+                ep.ewma_error = (1 - a) * ep.ewma_error
+                return
+            ep.errors += 1
+            ep.ewma_error = (1 - a) * ep.ewma_error + a
+            ep.last_error = type(exc).__name__
+            wait = retry_after(exc)
+            if wait is None and isinstance(exc, openai.RateLimitError):
+                wait = 1.0
+            if wait is None and _should_fail_over(exc):
+                # Short cool-down so the next request prefers another endpoint
+                wait = min(30.0, 0.5 * 2 ** min(ep.errors, 6))
+            if wait:
+                ep.blocked_until = max(ep.blocked_until, time.monotonic() + wait)
+
+    async def _attempt(self, ep: Endpoint, fn):
+        t0 = time.perf_counter()
+        with self._lock:
+            ep.inflight += 1
+        try:
+            result = await fn(ep.client, ep.deployment)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._record(ep, None, e)
+            raise
+        finally:
+            with self._lock:
+                ep.inflight -= 1
+        self._record(ep, time.perf_counter() - t0, None)
+        return result
+
+    async def call(self, fn: Callable[[object, str], Awaitable]):
+        """Run ``fn(client, deployment)`` on the best endpoint, failing over as needed.
+
+        With hedging enabled and more than one endpoint, a request that hasn't
+        finished after ``hedge_after_s`` is raced against the next endpoint and
+        the first success wins; the loser is cancelled.
+        """
+        candidates = self.ranked()
+        last_exc: Exception | None = None
+        i = 0
+        while i < len(candidates):
+            primary = asyncio.ensure_future(self._attempt(candidates[i], fn))
+            racers = [primary]
+            if self.hedge_after_s and i + 1 < len(candidates):
+                done, _ = await asyncio.wait(racers, timeout=self.hedge_after_s)
+                if not done:
+                    i += 1
+                    with self._lock:
+                        candidates[i].hedges += 1
+                    racers.append(asyncio.ensure_future(self._attempt(candidates[i], fn)))
+            try:
+                while racers:
+                    done, pending = await asyncio.wait(racers, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        racers.remove(task)
+                        if task.exception() is None:
+                            for other in racers:
+                                other.cancel()
+                                other.add_done_callback(_discard)
+                            return task.result()
+                        last_exc = task.exception()
+                        if not _should_fail_over(last_exc):
+                            for other in racers:
+                                other.cancel()
+                            raise last_exc
+            except asyncio.CancelledError:
+                for task in racers:
+                    task.cancel()
+                raise
+            i += 1
+        raise last_exc or NoHealthyEndpoint(self.service)
+
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "endpoint": ep.name,
+                "requests": ep.requests,
+                "errors": ep.errors,
+                "ewma_ms": round(ep.ewma_latency * 1000),
+                "error_rate": round(ep.ewma_error, 3),
+                "inflight": ep.inflight,
+                "hedges": ep.hedges,
+                "backoff_s": round(max(0.0, ep.blocked_until - now), 1),
+                "last_error": ep.last_error,
+            } for ep in self.endpoints]
+
+
+def build_pool(service: str, members: list[tuple[ServiceConfig, str | None]], deployment: str,
+               hedge_after_s: float = 0.0) -> EndpointPool:
+    """Pool over (config, deployment) pairs; entries without a deployment use ``deployment``."""
+    endpoints = []
+    for cfg, member_deployment in members:
+        # Fail over to another endpoint instead of retrying this one in place; retries
+        # happen in the engine, where admission control sees the 429s (see admission.py)
+        client = async_client_for(cfg).with_options(max_retries=0)
+        endpoints.append(Endpoint(cfg, member_deployment or deployment, client))
+    return EndpointPool(service, endpoints, hedge_after_s=hedge_after_s)
+
+
+def pool_from_settings(service: str) -> EndpointPool:
+    prefix = SERVICE_PREFIXES[service]
+    deployment = get_env_or_secret(f"{prefix}_DEPLOYMENT", DEFAULT_DEPLOYMENTS[service])
+    hedge_ms = get_number(f"{prefix}_HEDGE_MS", 0)
+    members = resolve_pool(prefix)
+    discovered = cached_service(service)
+    configured = get_env_or_secret(f"{prefix}_DEPLOYMENT")
+    # Discovery may fix the API version, but never swaps out an explicitly configured deployment
+    if configured and discovered is not None and discovered.deployment != configured:
+        discovered = None
+    if discovered is not None and not get_env_or_secret(f"{prefix}_POOL"):
+        cfg = members[0][0]
+        members = [(ServiceConfig(cfg.endpoint, discovered.api_version, cfg.api_key), discovered.deployment)]
+    return build_pool(service, members, deployment, hedge_after_s=hedge_ms / 1000)
+
+
+_pools: dict[str, EndpointPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(service: str) -> EndpointPool:
+    """Process-wide pool for "chat", "stt" or "tts" (health is shared by all sessions)."""
+    pool = _pools.get(service)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(service)
+            if pool is None:
+                pool = _pools[service] = pool_from_settings(service)
+    return pool
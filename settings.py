@@ -0,0 +1,96 @@
+"""
+Configuration lookup shared by the app and the helper scripts.
+
+Values come from the environment first, then Streamlit secrets. Each service
+(chat, Whisper, TTS) may override the global ``AZURE_OPENAI_*`` settings with
+its own ``AZURE_OPENAI_<SERVICE>_*`` prefix, or list several endpoints in
+``AZURE_OPENAI_<SERVICE>_POOL`` (see ``router.py``).
+"""
+import json
+import os
+from dataclasses import dataclass, field
+
+CHAT_PREFIX = "AZURE_OPENAI_CHAT"
+STT_PREFIX = "AZURE_OPENAI_WHISPER"
+TTS_PREFIX = "AZURE_OPENAI_TTS"
+
+
+def get_env_or_secret(key: str, default: str | None = None) -> str | None:
+    val = os.getenv(key)
+    if not val:
+        try:
+            import streamlit as st
+            # st.secrets returns None if key not present
+            val = st.secrets.get(key)  # type: ignore[attr-defined]
+        except Exception:
+            val = None
+    return val if val else default
+
+
+def get_number(key: str, default: float) -> float:
+    """Read a numeric setting, falling back to ``default`` when unset or invalid."""
+    try:
+        return float(get_env_or_secret(key) or default)
+    except ValueError:
+        return default
+
+
+@dataclass(frozen=True)
+class ServiceConfig:
+    endpoint: str | None
+    api_version: str | None
+    api_key: str | None = field(default=None, repr=False)
+
+
+def resolve_service(prefix: str) -> ServiceConfig:
+    """Resolve endpoint, API version and key for a service prefix."""
+    return ServiceConfig(
+        endpoint=get_env_or_secret(f"{prefix}_ENDPOINT") or get_env_or_secret("AZURE_OPENAI_ENDPOINT"),
+        api_version=get_env_or_secret(f"{prefix}_API_VERSION") or get_env_or_secret("AZURE_OPENAI_API_VERSION"),
+        api_key=get_env_or_secret(f"{prefix}_API_KEY") or get_env_or_secret("AZURE_OPENAI_API_KEY"),
+    )
+
+
+def resolve_pool(prefix: str) -> list[tuple[ServiceConfig, str | None]]:
+    """Resolve ``{prefix}_POOL`` into (config, deployment) pairs.
+
+    The pool is a JSON list of objects with optional ``endpoint``,
+    ``api_key``, ``api_version`` and ``deployment``; missing fields fall back
+    to the single-endpoint settings. Without a (valid) pool, that single
+    endpoint is the only entry.
+    """
+    base = resolve_service(prefix)
+    try:
+        entries = json.loads(get_env_or_secret(f"{prefix}_POOL") or "[]")
+    except ValueError:
+        entries = []
+    pool = [
+        (ServiceConfig(
+            endpoint=e.get("endpoint") or base.endpoint,
+            api_version=e.get("api_version") or base.api_version,
+            api_key=e.get("api_key") or base.api_key,
+        ), e.get("deployment"))
+        for e in (entries if isinstance(entries, list) else []) if isinstance(e, dict)
+    ]
+    return pool or [(base, None)]
+
+
+# Validate that either per-service or global credentials exist
+def missing_creds(prefix: str) -> list[str]:
+    missing: list[str] = []
+    for cfg, _ in resolve_pool(prefix):
+        for item in _missing_fields(prefix, cfg):
+            if item not in missing:
+                missing.append(item)
+    return missing
+
+
+def _missing_fields(prefix: str, cfg: ServiceConfig) -> list[str]:
+    missing: list[str] = []
+    if not cfg.api_key:
+        missing.append(f"{prefix}_API_KEY or AZURE_OPENAI_API_KEY")
+    if not cfg.endpoint:
+        missing.append(f"{prefix}_ENDPOINT or AZURE_OPENAI_ENDPOINT")
+    if not cfg.api_version:
+        missing.append(f"{prefix}_API_VERSION or AZURE_OPENAI_API_VERSION")
+    return missing
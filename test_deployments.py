@@ -35,24 +35,15 @@ except Exception as e:
 
 # Test 2: Test with alternative API versions
 print("\n🧪 Test 2: Trying different API versions...")
-api_versions = ["2024-10-21", "2024-08-01-preview", "2024-02-15-preview", "2023-12-01-preview"]
+from discovery import discover_service
+from engine import run_sync
 
-for api_ver in api_versions:
-    try:
-        test_client = AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version=api_ver,
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-        )
-        response = test_client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": "Hi"}],
-            max_tokens=10
-        )
-        print(f"✅ API version {api_ver} works!")
-        print(f"   Update your .env with: AZURE_OPENAI_API_VERSION={api_ver}")
-        break
-    except Exception as e:
-        print(f"❌ API version {api_ver} failed: {str(e)[:100]}")
+# Every (deployment, API version) candidate is probed at once; the first that works wins
+found = run_sync(discover_service("chat", log=lambda line: print(f"❌ {line.strip()[:100]}")))
+if found is not None:
+    print(f"✅ API version {found.api_version} works with deployment {found.deployment}!")
+    print(f"   Update your .env with: AZURE_OPENAI_API_VERSION={found.api_version}")
+else:
+    print("❌ No API version worked")
 
 print("\n" + "=" * 70)
@@ -0,0 +1,251 @@
+"""
+Content-addressed cache for synthesized speech.
+
+TTS output is deterministic for a given (deployment, voice, format, text), and
+many replies repeat (greetings, confirmations, error messages). Entries live in
+a bounded in-memory LRU backed by a size-bounded directory on disk, and
+concurrent requests for the same phrase share a single upstream call. The
+async path keeps disk reads and writes off the engine loop (``to_thread``).
+"""
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+from settings import get_env_or_secret, get_number
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of TTS input: NFC, trimmed, single spaces."""
+    return _WS.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(deployment: str, voice: str, fmt: str, text: str) -> str:
+    raw = "\x00".join([deployment, voice, fmt, normalize_text(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """Two-tier (memory + disk) LRU cache with in-flight request coalescing."""
+
+    def __init__(self, directory: Path | None, memory_bytes: int, disk_bytes: int):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = 0
+        self._inflight: dict[str, Future] = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._disk_used = sum(p.stat().st_size for p in directory.glob("*.audio"))
+
+    @classmethod
+    def from_env(cls) -> "TTSCache":
+        directory = get_env_or_secret("TTS_CACHE_DIR", str(Path(__file__).parent / ".cache" / "tts"))
+        return cls(
+            directory=Path(directory) if directory != "-" else None,
+            memory_bytes=int(get_number("TTS_CACHE_MEMORY_MB", 32) * 1024 * 1024),
+            disk_bytes=int(get_number("TTS_CACHE_DISK_MB", 512) * 1024 * 1024),
+        )
+
+    # --- Lookup ---
+    async def aget(self, key: str) -> bytes | None:
+        """Cached audio for ``key``; the disk tier is read in a worker thread, off the engine loop."""
+        data = self._memory_get(key)
+        if data is not None or self.directory is None:
+            return data
+        return await asyncio.to_thread(self._disk_get, key)
+
+    async def aget_or_create(self, key: str, produce) -> bytes:
+        """Return cached audio for ``key`` or await ``produce()`` (a coroutine function) once.
+
+        Callers that arrive while another coroutine is producing the same key
+        wait on its result instead of issuing their own request.
+        """
+        data = await self.aget(key)
+        if data is not None:
+            return data
+        # Each lookup is counted once: as a miss when it calls upstream, else as coalesced when it's over
+        while True:
+            with self._lock:
+                fut = self._inflight.get(key)
+                if fut is None:
+                    fut = self._inflight[key] = Future()
+                    self.stats["misses"] += 1
+                    break
+            try:
+                # Shielded: a follower being cancelled must not cancel the shared result
+                data = await asyncio.shield(asyncio.wrap_future(fut))
+            except asyncio.CancelledError:
+                if not fut.cancelled():
+                    self._count("coalesced")
+                    raise
+                # The leader's turn was cancelled (barge-in), not ours: take over, or follow whoever did
+                continue
+            except BaseException:
+                self._count("coalesced")
+                raise
+            self._count("coalesced")
+            return data
+        try:
+            data = await produce()
+            self._remember(key, data)
+            fut.set_result(data)
+        except asyncio.CancelledError:
+            # Unregister first, so the followers woken by the cancel can take over
+            with self._lock:
+                if self._inflight.get(key) is fut:
+                    del self._inflight[key]
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is fut:
+                    del self._inflight[key]
+        # Followers already have the clip; the disk copy is written off the loop
+        if self.directory is not None:
+            await asyncio.to_thread(self._write_disk, key, data)
+        return data
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "disk_bytes": self._disk_used,
+            }
+
+    # --- Memory tier ---
+    def _memory_get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+            return data
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_used -= len(old)
+            self._memory[key] = data
+            self._memory_used += len(data)
+            while self._memory_used > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+
+    # --- Disk tier ---
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.audio"
+
+    def _disk_get(self, key: str) -> bytes | None:
+        data = self._read_disk(key)
+        if data is not None:
+            with self._lock:
+                self.stats["disk_hits"] += 1
+            self._remember(key, data)
+        return data
+
+    def _read_disk(self, key: str) -> bytes | None:
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            # Bump mtime so eviction treats this entry as recently used
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        if self.directory is None or len(data) > self.disk_bytes:
+            return
+        path = self._path(key)
+        try:
+            # Write to a temp file and rename so readers never see a partial clip
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            existed = path.exists()
+            os.replace(tmp, path)
+        except OSError:
+            # Disk full or similar: don't leave the partial temp file behind
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if not existed:
+                self._disk_used += len(data)
+            over = self._disk_used > self.disk_bytes
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        entries = []
+        for p in self.directory.glob("*.audio"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+        used = sum(size for _, size, _ in entries)
+        # Evict down to 90% of the budget so eviction doesn't run on every write
+        target = int(self.disk_bytes * 0.9)
+        evicted = 0
+        for _, size, p in entries:
+            if used <= target:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            used -= size
+            evicted += 1
+        with self._lock:
+            self._disk_used = used
+            self.stats["evictions"] += evicted
+
+
+_cache: TTSCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache() -> TTSCache | None:
+    """Process-wide TTS cache, or None when disabled with TTS_CACHE_ENABLED=0."""
+    global _cache
+    if (get_env_or_secret("TTS_CACHE_ENABLED", "1") or "1").lower() in ("0", "false", "no"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TTSCache.from_env()
+    return _cache
@@ -0,0 +1,128 @@
+"""
+Energy-based voice activity detection that splits speech at pauses.
+
+``SpeechSegmenter`` takes 16-bit mono PCM incrementally and closes a segment
+at the first long-enough pause once the segment has reached a minimum
+length (or forcibly at a maximum length). Each closed segment can be sent to
+Whisper on its own while later audio is still arriving, and the transcripts
+stitched back in order.
+"""
+import math
+from array import array
+from dataclasses import dataclass
+
+
+@dataclass
+class Segment:
+    index: int
+    start_ms: int
+    end_ms: int
+    pcm: bytes
+
+    @property
+    def duration_ms(self) -> int:
+        return self.end_ms - self.start_ms
+
+
+class SpeechSegmenter:
+    """Split a PCM stream into speech segments at silence boundaries.
+
+    A frame counts as silent when it is ``threshold_db`` below the recent
+    speech level (a peak follower that decays slowly), so the detector adapts
+    to quiet and loud microphones alike. Segments are cut in the middle of a
+    pause of at least ``min_silence_ms`` once they are ``min_segment_ms`` long;
+    a segment that reaches ``max_segment_ms`` without a pause is cut anyway.
+    Leading/trailing silence beyond ``padding_ms`` is dropped, and segments
+    with no speech at all are not emitted.
+    """
+
+    def __init__(self, rate: int = 16000, frame_ms: int = 30, threshold_db: float = 16.0,
+                 min_silence_ms: int = 400, min_segment_ms: int = 5000, max_segment_ms: int = 25000,
+                 padding_ms: int = 200):
+        self.rate = rate
+        self.frame_ms = frame_ms
+        self.frame_bytes = rate * frame_ms // 1000 * 2
+        self.threshold_db = threshold_db
+        self.min_silence_frames = max(1, min_silence_ms // frame_ms)
+        self.min_segment_frames = max(1, min_segment_ms // frame_ms)
+        self.max_segment_frames = max(self.min_segment_frames, max_segment_ms // frame_ms)
+        self.padding_frames = padding_ms // frame_ms
+        self._pending = b""
+        self._frames: list[bytes] = []
+        self._voiced: list[bool] = []
+        self._start_frame = 0  # absolute index of self._frames[0]
+        self._speech_db = -60.0
+        self._emitted = 0
+
+    def _frame_db(self, frame: bytes) -> float:
+        samples = array("h", frame)
+        if not samples:
+            return -120.0
+        rms = math.sqrt(sum(s * s for s in samples) / len(samples))
+        return 20 * math.log10(rms / 32768) if rms else -120.0
+
+    def feed(self, pcm: bytes) -> list[Segment]:
+        """Add PCM and return the segments that closed."""
+        data = self._pending + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._pending = data[usable:]
+        out: list[Segment] = []
+        for pos in range(0, usable, self.frame_bytes):
+            frame = data[pos:pos + self.frame_bytes]
+            db = self._frame_db(frame)
+            # Peak follower: jumps up with speech, decays ~1.5 dB/s through pauses
+            self._speech_db = max(db, self._speech_db - 0.05 * self.frame_ms / 30)
+            self._frames.append(frame)
+            self._voiced.append(db > max(self._speech_db - self.threshold_db, -60.0))
+            out.extend(self._maybe_cut())
+        return out
+
+    def flush(self) -> list[Segment]:
+        """Close whatever is buffered once the stream ends."""
+        if self._pending:
+            self._frames.append(self._pending)
+            self._voiced.append(False)
+            self._pending = b""
+        segment = self._emit(len(self._frames))
+        return [segment] if segment else []
+
+    def _maybe_cut(self) -> list[Segment]:
+        n = len(self._frames)
+        if n >= self.max_segment_frames:
+            return [s for s in [self._emit(n)] if s]
+        if n < self.min_segment_frames + self.min_silence_frames:
+            return []
+        run = 0
+        for voiced in reversed(self._voiced):
+            if voiced:
+                break
+            run += 1
+        if run < self.min_silence_frames or run == n:
+            return []
+        # Cut in the middle of the pause so neither side loses a word edge
+        cut = n - run // 2
+        return [s for s in [self._emit(cut)] if s]
+
+    def _emit(self, cut: int) -> Segment | None:
+        frames, voiced = self._frames[:cut], self._voiced[:cut]
+        start_frame = self._start_frame
+        self._frames, self._voiced = self._frames[cut:], self._voiced[cut:]
+        self._start_frame += cut
+        if not any(voiced):
+            return None
+        first = max(0, voiced.index(True) - self.padding_frames)
+        last = min(len(voiced), len(voiced) - voiced[::-1].index(True) + self.padding_frames)
+        segment = Segment(
+            index=self._emitted,
+            start_ms=(start_frame + first) * self.frame_ms,
+            end_ms=(start_frame + last) * self.frame_ms,
+            pcm=b"".join(frames[first:last]),
+        )
+        self._emitted += 1
+        return segment
+
+
+def split_speech(pcm: bytes, rate: int = 16000, **kwargs) -> list[Segment]:
+    """Segment a complete PCM buffer (same rules as the streaming segmenter)."""
+    segmenter = SpeechSegmenter(rate, **kwargs)
+    return segmenter.feed(pcm) + segmenter.flush()
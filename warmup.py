@@ -0,0 +1,168 @@
+"""
+Opt-in warm-up of the Azure endpoints, once per server process.
+
+Without it, the first turn after a deploy or a long idle period pays for
+DNS, the TLS handshake and any cold model path on Whisper, chat and TTS, one
+after the other. With ``WARMUP_ENABLED=1`` the first script run starts a
+background warm-up on the engine loop: every endpoint in the chat, Whisper
+and TTS pools gets the smallest real request (see ``discovery.probe``) in
+parallel, which leaves an open pooled connection behind. While the server is
+idle the probes are repeated every ``WARMUP_REFRESH_S`` so connections and
+model paths don't go cold again. The first real turn of the process is
+recorded as cold or warm so the difference shows up in Diagnostics and in
+/metrics (``first_turn_cold`` / ``first_turn_warm``).
+"""
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+
+from discovery import probe
+from metrics import Metrics, StageRecord, metrics
+from router import EndpointPool
+from settings import get_env_or_secret, get_number
+
+
+@dataclass
+class ProbeResult:
+    service: str
+    endpoint: str
+    seconds: float
+    error: str = ""
+    at: float = 0.0
+
+
+class Warmup:
+    """Warms every endpoint of the given pools, then keeps them warm while idle."""
+
+    def __init__(self, pools: dict[str, EndpointPool], refresh_s: float = 240.0, timeout_s: float = 10.0,
+                 registry: Metrics = metrics):
+        self.pools = pools
+        self.refresh_s = refresh_s
+        self.timeout_s = timeout_s
+        self.registry = registry
+        self.state = "pending"  # → warming → warm | failed
+        self.started_at = 0.0
+        self.finished_at = 0.0
+        self.rounds = 0
+        self.first: dict[tuple[str, str], ProbeResult] = {}
+        self.last: dict[tuple[str, str], ProbeResult] = {}
+        self._task: asyncio.Task | None = None
+
+    async def _probe(self, service: str, ep) -> ProbeResult:
+        t0 = time.perf_counter()
+        error = ""
+        try:
+            await asyncio.wait_for(probe(service, ep.client, ep.deployment), self.timeout_s)
+        except Exception as e:
+            error = type(e).__name__
+        result = ProbeResult(service, ep.name, time.perf_counter() - t0, error, time.time())
+        self.registry.record(StageRecord("warmup", started=result.at, seconds=result.seconds, error=error,
+                                         labels={"service": service}))
+        return result
+
+    async def warm_once(self) -> list[ProbeResult]:
+        """Probe every endpoint of every pool concurrently."""
+        results = await asyncio.gather(*(self._probe(svc, ep)
+                                         for svc, pool in self.pools.items() for ep in pool.endpoints))
+        for result in results:
+            key = (result.service, result.endpoint)
+            self.first.setdefault(key, result)
+            self.last[key] = result
+        self.rounds += 1
+        return results
+
+    def _activity(self) -> int:
+        return sum(ep.requests for pool in self.pools.values() for ep in pool.endpoints)
+
+    async def run(self) -> None:
+        """Warm up, then refresh whenever a whole interval passes without real traffic."""
+        self._task = asyncio.current_task()
+        self.state, self.started_at = "warming", time.time()
+        results = await self.warm_once()
+        self.finished_at = time.time()
+        self.state = "warm" if any(not r.error for r in results) else "failed"
+        if self.refresh_s <= 0:
+            return
+        seen = self._activity()
+        while True:
+            await asyncio.sleep(self.refresh_s)
+            # Real turns keep their own connections warm; only fill the gaps
+            if self._activity() == seen:
+                results = await self.warm_once()
+                if any(not r.error for r in results):
+                    self.state = "warm"
+            seen = self._activity()
+
+    def snapshot(self) -> list[dict]:
+        """One row per endpoint: the first (cold) probe and the latest one."""
+        now = time.time()
+        rows = []
+        for key, first in self.first.items():
+            last = self.last[key]
+            rows.append({
+                "service": first.service,
+                "endpoint": first.endpoint,
+                "cold_ms": round(first.seconds * 1000),
+                "latest_ms": round(last.seconds * 1000) if last is not first else None,
+                "age_s": round(now - last.at),
+                "error": last.error,
+            })
+        return rows
+
+
+# --- First turn of the process ---
+_first_turn: dict | None = None
+_first_turn_lock = threading.Lock()
+
+
+def note_turn(seconds: float, registry: Metrics = metrics) -> None:
+    """Record the process's first completed turn as cold or warm (later turns are ignored)."""
+    global _first_turn
+    if _first_turn is not None:
+        return
+    with _first_turn_lock:
+        if _first_turn is not None:
+            return
+        kind = "warm" if _warmup is not None and _warmup.state == "warm" else "cold"
+        _first_turn = {"kind": kind, "seconds": seconds, "at": time.time()}
+    registry.observe(f"first_turn_{kind}", seconds)
+
+
+def first_turn() -> dict | None:
+    return _first_turn
+
+
+# --- Process-wide warm-up ---
+_warmup: Warmup | None = None
+_warmup_lock = threading.Lock()
+
+
+def warmup_enabled() -> bool:
+    return (get_env_or_secret("WARMUP_ENABLED", "0") or "0").lower() in ("1", "true", "yes")
+
+
+def start_warmup() -> Warmup | None:
+    """Start the warm-up on the engine loop once per process (None when disabled)."""
+    global _warmup
+    if _warmup is not None or not warmup_enabled():
+        return _warmup
+    with _warmup_lock:
+        if _warmup is None:
+            from engine import submit
+            from router import get_pool
+
+            services = [s.strip() for s in (get_env_or_secret("WARMUP_SERVICES", "chat,stt,tts") or "").split(",")
+                        if s.strip() in ("chat", "stt", "tts")]
+            warmup = Warmup(
+                {svc: get_pool(svc) for svc in services},
+                refresh_s=get_number("WARMUP_REFRESH_S", 240),
+                timeout_s=get_number("WARMUP_TIMEOUT_S", 10),
+            )
+            submit(warmup.run())
+            _warmup = warmup
+    return _warmup
+
+
+def get_warmup() -> Warmup | None:
+    return _warmup